@@ -0,0 +1,236 @@
+import argparse
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, Dataset
+from segan.models import SEGAN, WSEGAN, AEWSEGAN
+from train import make_parser
+import multiprocessing as mp
+import numpy as np
+import resource
+import contextlib
+import tempfile
+import shutil
+import random
+import json
+
+
+class ArgParser(object):
+
+    def __init__(self, args):
+        for k, v in args.items():
+            setattr(self, k, v)
+
+
+class SyntheticSEDataset(Dataset):
+    """ Random (clean, noisy) slices, in memory, shaped like the ones
+        of SEDataset so that the train loops run unchanged
+    """
+    def __init__(self, num_samples, slice_size, seed=0):
+        rng = np.random.RandomState(seed)
+        self.clean = rng.randn(num_samples, slice_size).astype(np.float32)
+        self.clean *= 0.1
+        noise = rng.randn(num_samples, slice_size).astype(np.float32)
+        self.noisy = self.clean + 0.05 * noise
+
+    def __getitem__(self, index):
+        # additive uttnames, so that WSEGAN also computes its den_loss
+        return ('additive_{}'.format(index),
+                torch.from_numpy(self.clean[index]),
+                torch.from_numpy(self.noisy[index]),
+                torch.LongTensor([0]))
+
+    def __len__(self):
+        return self.clean.shape[0]
+
+
+class SavedTensor(object):
+    """ Tensor kept by autograd for backward, counted by a SavedBytes
+        while the graph holds it
+    """
+    def __init__(self, counter, tensor):
+        self.counter = counter
+        self.tensor = tensor
+        if hasattr(tensor, 'untyped_storage'):
+            storage = tensor.untyped_storage()
+            nbytes = storage.nbytes()
+        else:
+            storage = tensor.storage()
+            nbytes = storage.size() * storage.element_size()
+        self.key = storage.data_ptr()
+        counter.ref(self.key, nbytes)
+
+    def __del__(self):
+        self.counter.unref(self.key)
+
+
+class SavedBytes(object):
+    """ saved_tensors_hooks pack/unpack pair tracking the bytes of the
+        activations alive for backward (parameters left out, storages
+        shared by several saved tensors counted once) and their peak
+    """
+    def __init__(self):
+        self.live = 0
+        self.peak = 0
+        self.refs = {}
+
+    def ref(self, key, nbytes):
+        if key not in self.refs:
+            self.refs[key] = [0, nbytes]
+            self.live += nbytes
+            self.peak = max(self.peak, self.live)
+        self.refs[key][0] += 1
+
+    def unref(self, key):
+        self.refs[key][0] -= 1
+        if self.refs[key][0] == 0:
+            self.live -= self.refs.pop(key)[1]
+
+    def pack(self, tensor):
+        if tensor.is_leaf and tensor.requires_grad:
+            # a parameter, not an activation
+            return tensor
+        return SavedTensor(self, tensor)
+
+    def unpack(self, saved):
+        if isinstance(saved, SavedTensor):
+            return saved.tensor
+        return saved
+
+
+def bench_config(cfg, config, opts):
+    """ Train iters + warmup batches of random data with one config
+        (features joined with '+', e.g. amp+compile) and measure it
+
+        # Returns
+            (samples/s, peak MB of activations saved for backward, peak
+             memory in MB, memory kind)
+    """
+    args = ArgParser(dict(cfg))
+    features = config.split('+')
+    args.amp = 'amp' in features
+    args.d_checkpoint = 'dckpt' in features
+    args.g_checkpoint = []
+    args.micro_batch = None
+    for feature in features:
+        if feature.startswith('gckpt:'):
+            args.g_checkpoint = feature.split(':', 1)[1].split(',')
+        elif feature.startswith('mb:'):
+            args.micro_batch = int(feature.split(':', 1)[1])
+    args.epoch = 1
+    args.no_train_gen = True
+    args.batch_size = opts.batch_size
+    args.slice_size = opts.slice_size
+    # D output length of this slice size, with the pooling of cfg
+    args.dpool_slen = opts.slice_size * cfg['dpool_slen'] // \
+                      cfg['slice_size']
+    args.save_path = tempfile.mkdtemp(prefix='bench_')
+    device = 'cuda' if opts.cuda else 'cpu'
+    args.cuda = opts.cuda
+    random.seed(opts.seed)
+    np.random.seed(opts.seed)
+    torch.manual_seed(opts.seed)
+    if getattr(args, 'wsegan', False):
+        segan = WSEGAN(args)
+    elif getattr(args, 'aewsegan', False):
+        segan = AEWSEGAN(args)
+    else:
+        segan = SEGAN(args)
+    segan.to(device)
+    if 'compile' in features:
+        segan.compile_graphs()
+    num_batches = opts.iters + opts.warmup
+    dset = SyntheticSEDataset(num_batches * opts.batch_size,
+                              opts.slice_size, seed=opts.seed)
+    dloader = DataLoader(dset, batch_size=opts.batch_size, shuffle=False)
+    if opts.cuda:
+        if hasattr(torch.cuda, 'reset_peak_memory_stats'):
+            torch.cuda.reset_peak_memory_stats()
+        else:
+            torch.cuda.reset_max_memory_allocated()
+    saved = SavedBytes()
+    graph = getattr(torch.autograd, 'graph', None)
+    if graph is not None and hasattr(graph, 'saved_tensors_hooks'):
+        saved_ctx = graph.saved_tensors_hooks(saved.pack, saved.unpack)
+    else:
+        saved.peak = np.nan
+        saved_ctx = contextlib.suppress()
+    try:
+        with saved_ctx:
+            segan.train(args, dloader, nn.MSELoss(), args.l1_weight,
+                        args.l1_dec_step, args.l1_dec_epoch, num_batches,
+                        va_dloader=None, device=device)
+    finally:
+        if hasattr(segan, 'writer'):
+            segan.writer.close()
+        shutil.rmtree(args.save_path)
+    timings = segan.timings[opts.warmup:]
+    samples_s = opts.batch_size * len(timings) / np.sum(timings)
+    saved_mb = saved.peak / 2 ** 20
+    if opts.cuda:
+        return samples_s, saved_mb, \
+               torch.cuda.max_memory_allocated() / 2 ** 20, \
+               'cuda max allocated'
+    # ru_maxrss is in KB on linux
+    return samples_s, saved_mb, \
+           resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10, \
+           'peak RSS'
+
+
+def main(opts):
+    with open(opts.cfg_file, 'r') as cfg_f:
+        cfg = json.load(cfg_f)
+    # options added to train.py after cfg_file was written
+    for k, v in vars(make_parser().parse_args([])).items():
+        cfg.setdefault(k, v)
+    cfg.setdefault('bias', not cfg['no_bias'])
+    if opts.batch_size is None:
+        opts.batch_size = cfg['batch_size']
+    if opts.slice_size is None:
+        opts.slice_size = cfg['slice_size']
+    results = []
+    for config in opts.configs:
+        # fresh process per config, so memory peaks are its own
+        pool = mp.get_context('spawn').Pool(1)
+        results.append(pool.apply(bench_config, (cfg, config, opts)))
+        pool.close()
+        pool.join()
+    print('Batch size {}, slice size {}, {} timed '
+          'iterations'.format(opts.batch_size, opts.slice_size, opts.iters))
+    base_s = results[0][0]
+    for config, (samples_s, saved_mb, mem, mem_kind) in zip(opts.configs,
+                                                            results):
+        print('{:>16s}: {:10.1f} samples/s (x{:.2f}), {:9.1f} MB peak saved '
+              'for backward, {:9.1f} MB '
+              '{}'.format(config, samples_s, samples_s / base_s, saved_mb,
+                          mem, mem_kind))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark training '
+                                                 'speed and memory of a '
+                                                 'train.opts config on '
+                                                 'random data')
+    parser.add_argument('--cfg_file', type=str, default=None,
+                        help='train.opts of the model to benchmark.')
+    parser.add_argument('--configs', type=str, nargs='+',
+                        default=['fp32', 'amp'],
+                        help='Configs to compare, features (amp, '
+                             'compile, dckpt, gckpt:<blocks,...>, '
+                             'mb:<micro_batch>) joined by +, or fp32 for '
+                             'none (Def: fp32 amp).')
+    parser.add_argument('--batch_size', type=int, default=None,
+                        help='Def: the one of cfg_file.')
+    parser.add_argument('--slice_size', type=int, default=None,
+                        help='Def: the one of cfg_file.')
+    parser.add_argument('--iters', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=3,
+                        help='Untimed first iterations (Def: 3).')
+    parser.add_argument('--seed', type=int, default=111)
+    parser.add_argument('--no-cuda', action='store_true', default=False)
+
+    opts = parser.parse_args()
+    opts.cuda = torch.cuda.is_available() and not opts.no_cuda
+
+    assert opts.cfg_file is not None
+
+    main(opts)
@@ -42,6 +42,8 @@ def main(opts):
     segan.G.load_pretrained(opts.g_pretrained_ckpt, True)
     if opts.cuda:
         segan.cuda()
+    if opts.compile:
+        segan.compile_graphs()
     segan.G.eval()
     if opts.h5:
         with h5py.File(opts.test_files[0], 'r') as f:
@@ -93,6 +95,9 @@ if __name__ == '__main__':
                              'segan_samples).')
     parser.add_argument('--cuda', action='store_true', default=False)
     parser.add_argument('--soundfile', action='store_true', default=False)
+    parser.add_argument('--compile', action='store_true', default=False,
+                        help='Run G through its graph forward, compiled '
+                             'with torch.compile (Def: False).')
     parser.add_argument('--cfg_file', type=str, default=None)
 
     opts = parser.parse_args()
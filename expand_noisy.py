@@ -0,0 +1,168 @@
+import argparse
+import os
+import json
+import glob
+import hashlib
+import timeit
+import multiprocessing as mp
+import numpy as np
+import soundfile as sf
+import torch
+from segan.utils import Additive
+
+# noise bank of the pool workers and its noise lengths, set by
+# init_worker
+worker_additive = None
+worker_noise_lens = None
+
+def init_worker(additive):
+    global worker_additive, worker_noise_lens
+    worker_additive = additive
+    worker_noise_lens = np.array([additive.noise_data(n_i).shape[0] \
+                                  for n_i in range(additive.num_noises())])
+
+def file_seed(seed, bname):
+    # same seed for a file in every run, whatever its shard or worker
+    digest = hashlib.sha1('{}_{}'.format(seed, bname).encode('utf-8'))
+    return int(digest.hexdigest()[:8], 16)
+
+def expand_file(additive, noise_lens, clean_path, out_dir, snr_levels,
+                seed):
+    """ Mix one clean wav with a noise of the bank (of noise_lens
+        samples each), write it to out_dir and return its manifest record
+    """
+    bname = os.path.splitext(os.path.basename(clean_path))[0]
+    clean, rate = sf.read(clean_path, dtype='float32')
+    if clean.ndim > 1:
+        clean = np.mean(clean, axis=1)
+    rng = np.random.RandomState(file_seed(seed, bname))
+    valid = np.flatnonzero(noise_lens > clean.shape[0])
+    if valid.shape[0] == 0:
+        raise ValueError('No noise longer than {} ({} '
+                         'samples)'.format(clean_path, clean.shape[0]))
+    noise_idx = int(rng.choice(valid))
+    snr = float(rng.choice(snr_levels))
+    offset = int(rng.randint(0, noise_lens[noise_idx] - clean.shape[0] + 1))
+    level = additive.asl_P56(clean, rate, 16)[0]
+    noisy = additive.mix_batch(torch.from_numpy(clean).unsqueeze(0),
+                               snrs=[snr], noise_idxs=[noise_idx],
+                               offsets=[offset], levels=[level])[0][0]
+    out_path = os.path.join(out_dir, bname + '.wav')
+    sf.write(out_path, noisy.numpy(), rate, subtype='PCM_16')
+    return {'file':out_path, 'clean':clean_path, 'snr':snr,
+            'noise':additive.noise_files[noise_idx],
+            'noise_bounds':[offset, offset + clean.shape[0]]}
+
+def shard_params(clean_paths, snr_levels, seed, noise_files):
+    """ What a shard's output depends on, stored as the header line
+        of its manifest
+    """
+    return {'files':clean_paths, 'snr_levels':list(snr_levels),
+            'seed':seed, 'noises':noise_files}
+
+def shard_done(shard_path, params):
+    """ Whether shard_path is the manifest of a shard expanded with
+        params (and not of a previous run with other ones)
+    """
+    if not os.path.exists(shard_path):
+        return False
+    with open(shard_path, 'r') as shard_f:
+        header = shard_f.readline()
+    try:
+        return json.loads(header).get('shard') == params
+    except ValueError:
+        return False
+
+def expand_shard(args):
+    """ Expand the files of one shard, writing its manifest last (and
+        atomically) so that a finished shard is never redone
+    """
+    shard_idx, clean_paths, out_dir, snr_levels, seed, params = args
+    records = [expand_file(worker_additive, worker_noise_lens, clean_path,
+                           out_dir, snr_levels, seed) \
+               for clean_path in clean_paths]
+    shard_path = os.path.join(out_dir, 'manifest_{:05d}.jsonl'.format(shard_idx))
+    with open(shard_path + '.tmp', 'w') as shard_f:
+        shard_f.write(json.dumps({'shard':params}) + '\n')
+        for record in records:
+            shard_f.write(json.dumps(record) + '\n')
+    os.rename(shard_path + '.tmp', shard_path)
+    return shard_idx, len(records)
+
+def main(opts):
+    if not os.path.exists(opts.out_dir):
+        os.makedirs(opts.out_dir)
+    bank_path = opts.bank_path
+    if bank_path is None:
+        bank_path = os.path.join(opts.out_dir, 'noise_bank')
+    # no level caching, every clean file is mixed once
+    additive = Additive(opts.noises_dir, snr_levels=opts.snr_levels,
+                        asl_cache_size=0, bank_path=bank_path,
+                        workers=opts.workers)
+    clean_paths = sorted(glob.glob(os.path.join(opts.clean_dir, '*.wav')))
+    shards = [clean_paths[beg:beg + opts.shard_size] for beg in \
+              range(0, len(clean_paths), opts.shard_size)]
+    # resume: skip the shards whose manifest was written, with the
+    # same files and parameters
+    todo = []
+    for shard_idx, shard in enumerate(shards):
+        shard_path = os.path.join(opts.out_dir,
+                                  'manifest_{:05d}.jsonl'.format(shard_idx))
+        params = shard_params(shard, opts.snr_levels, opts.seed,
+                              additive.noise_files)
+        if not shard_done(shard_path, params):
+            todo.append((shard_idx, shard, opts.out_dir, opts.snr_levels,
+                         opts.seed, params))
+    print('Expanding {} clean files in {} shards ({} already '
+          'done)'.format(len(clean_paths), len(shards),
+                         len(shards) - len(todo)))
+    beg_t = timeit.default_timer()
+    if opts.workers > 1:
+        pool = mp.Pool(opts.workers, initializer=init_worker,
+                       initargs=(additive,))
+        results = pool.imap_unordered(expand_shard, todo)
+    else:
+        init_worker(additive)
+        results = map(expand_shard, todo)
+    for s_i, (shard_idx, num_files) in enumerate(results, start=1):
+        print('Expanded shard {} ({} files), {}/{} in {:.1f} '
+              's'.format(shard_idx, num_files, s_i, len(todo),
+                         timeit.default_timer() - beg_t))
+    if opts.workers > 1:
+        pool.close()
+        pool.join()
+    # merged manifest of all shards, in clean files order
+    with open(os.path.join(opts.out_dir, 'manifest.jsonl'), 'w') as man_f:
+        for shard_idx in range(len(shards)):
+            shard_path = os.path.join(opts.out_dir,
+                                      'manifest_{:05d}.jsonl'.format(shard_idx))
+            with open(shard_path, 'r') as shard_f:
+                # records, after the header line
+                shard_f.readline()
+                man_f.write(shard_f.read())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Expand a clean wav dir '
+                                                 'into a noisy one with '
+                                                 'the noises of a dir')
+    parser.add_argument('--clean_dir', type=str, default=None)
+    parser.add_argument('--noises_dir', type=str, default=None)
+    parser.add_argument('--out_dir', type=str, default=None,
+                        help='Dir of noisy wavs and manifests (Def: None).')
+    parser.add_argument('--snr_levels', type=float, nargs='+',
+                        default=[0, 5, 10])
+    parser.add_argument('--bank_path', type=str, default=None,
+                        help='Noise bank prefix (Def: out_dir/noise_bank).')
+    parser.add_argument('--shard_size', type=int, default=500,
+                        help='Files per shard, the unit of work and of '
+                             'resuming (Def: 500).')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=111)
+
+    opts = parser.parse_args()
+
+    assert opts.clean_dir is not None
+    assert opts.noises_dir is not None
+    assert opts.out_dir is not None
+
+    main(opts)
@@ -0,0 +1,121 @@
+import argparse
+import os
+import timeit
+import multiprocessing as mp
+import numpy as np
+import h5py
+from segan.datasets import SEDataset
+
+# dataset of the pool workers, set by init_worker
+worker_dset = None
+
+def init_worker(dset):
+    global worker_dset
+    worker_dset = dset
+
+def slice_file(idxs):
+    """ Processed (clean, noisy) slices of one file, as SEDataset
+        extracts them, with their uttname and slice indexes
+    """
+    c_slices = []
+    n_slices = []
+    slice_idxs = []
+    for index in idxs:
+        c_slice, n_slice, _, _, slice_idx, bname = \
+                worker_dset.extract_slice(index)
+        c_slices.append(c_slice)
+        n_slices.append(n_slice)
+        slice_idxs.append(slice_idx)
+    return (idxs, np.array(c_slices, dtype=np.float32),
+            np.array(n_slices, dtype=np.float32), bname,
+            np.array(slice_idxs, dtype=np.int32))
+
+def main(opts):
+    if not os.path.exists(opts.h5_data_root):
+        os.makedirs(opts.h5_data_root)
+    dset = SEDataset(opts.clean_dir, opts.noisy_dir, opts.preemph,
+                     cache_dir=opts.cache_dir, split=opts.split,
+                     slice_size=opts.slice_size, stride=opts.data_stride,
+                     max_samples=opts.max_samples, verbose=True,
+                     slice_workers=opts.workers,
+                     preemph_norm=opts.preemph_norm)
+    num_slices = len(dset)
+    file_ids = np.asarray(dset.slice_table['file_id'])
+    # slices of each file, read together by a worker
+    order = np.argsort(file_ids, kind='mergesort')
+    bounds = np.flatnonzero(np.diff(file_ids[order])) + 1
+    jobs = np.split(order, bounds)
+    h5_file = os.path.join(opts.h5_data_root, opts.split + '.h5')
+    # chunks of whole rows, so a batch of rows is a few chunk reads
+    chunk_rows = max(1, min(opts.chunk_rows, num_slices))
+    beg_t = timeit.default_timer()
+    with h5py.File(h5_file, 'w') as f:
+        kwargs = {'chunks':(chunk_rows, opts.slice_size),
+                  'compression':opts.compression}
+        data = f.create_dataset('data', (num_slices, opts.slice_size),
+                                dtype=np.float32, **kwargs)
+        label = f.create_dataset('label', (num_slices, opts.slice_size),
+                                 dtype=np.float32, **kwargs)
+        uttname = f.create_dataset('uttname', (num_slices,),
+                                   dtype=h5py.special_dtype(vlen=str))
+        slice_idx = f.create_dataset('slice_idx', (num_slices,),
+                                     dtype=np.int32)
+        if opts.workers > 1:
+            pool = mp.Pool(opts.workers, initializer=init_worker,
+                           initargs=(dset,))
+            results = pool.imap(slice_file, jobs)
+        else:
+            init_worker(dset)
+            results = map(slice_file, jobs)
+        for j_i, (idxs, c_slices, n_slices, bname, s_idxs) in \
+                enumerate(results, start=1):
+            if idxs[-1] - idxs[0] + 1 == idxs.shape[0]:
+                sel = slice(int(idxs[0]), int(idxs[-1]) + 1)
+            else:
+                sel = idxs
+            data[sel] = c_slices
+            label[sel] = n_slices
+            uttname[sel] = [bname] * idxs.shape[0]
+            slice_idx[sel] = s_idxs
+            if j_i % 100 == 0:
+                print('Written {}/{} files'.format(j_i, len(jobs)))
+        if opts.workers > 1:
+            pool.close()
+            pool.join()
+    end_t = timeit.default_timer()
+    print('Written {} slices of {} files to {} in {} s'.format(num_slices,
+                                                               len(jobs),
+                                                               h5_file,
+                                                               end_t - beg_t))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Slice clean/noisy wav '
+                                                 'dirs into an H5 file '
+                                                 'for SEH5Dataset')
+    parser.add_argument('--clean_dir', type=str, default=None)
+    parser.add_argument('--noisy_dir', type=str, default=None)
+    parser.add_argument('--h5_data_root', type=str, default=None,
+                        help='Output dir of {split}.h5 (Def: None).')
+    parser.add_argument('--split', type=str, default='train')
+    parser.add_argument('--cache_dir', type=str, default='data_cache')
+    parser.add_argument('--slice_size', type=int, default=16384)
+    parser.add_argument('--data_stride', type=float,
+                        default=0.5, help='Stride in seconds for data read')
+    parser.add_argument('--preemph', type=float, default=0.95)
+    parser.add_argument('--preemph_norm', action='store_true', default=False)
+    parser.add_argument('--max_samples', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--chunk_rows', type=int, default=100,
+                        help='Rows per HDF5 chunk, e.g. the batch size '
+                             '(Def: 100).')
+    parser.add_argument('--compression', type=str, default=None,
+                        choices=['gzip', 'lzf'],
+                        help='HDF5 compression filter (Def: None).')
+
+    opts = parser.parse_args()
+
+    assert opts.clean_dir is not None
+    assert opts.noisy_dir is not None
+    assert opts.h5_data_root is not None
+
+    main(opts)
@@ -1,2 +1,5 @@
 from .se_dataset import *
 from .vc_dataset import *
+from .packed import *
+from .manifest import *
+from .samplers import *
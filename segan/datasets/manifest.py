@@ -0,0 +1,189 @@
+from __future__ import print_function
+import os
+import glob
+import json
+import hashlib
+import timeit
+import multiprocessing as mp
+import numpy as np
+import soundfile as sf
+
+
+def wav_key(path):
+    # pair key of a wav is its basename without extension
+    return os.path.splitext(os.path.basename(path))[0]
+
+def met_path(path):
+    # per utterance metrics sidecar of a wav
+    return os.path.splitext(path)[0] + '.met'
+
+def met_mtime(path):
+    try:
+        return os.stat(met_path(path)).st_mtime
+    except FileNotFoundError:
+        return None
+
+def wav_record(path):
+    """ Manifest record of a wav file, reading only its header and
+        its .met sidecar (pesq and ssnr), if any
+    """
+    stat = os.stat(path)
+    info = sf.info(path)
+    rec = {'path':path, 'key':wav_key(path),
+           'size':stat.st_size, 'mtime':stat.st_mtime,
+           'rate':info.samplerate, 'length':info.frames,
+           'met_mtime':met_mtime(path)}
+    if rec['met_mtime'] is not None:
+        with open(met_path(path), 'r') as met_f:
+            metrics = json.load(met_f)
+        rec['pesq'] = metrics['pesq']
+        rec['ssnr'] = metrics['ssnr']
+    return rec
+
+def scan_wav_dir(wav_dir, records=None, workers=1):
+    """ Make the records of all wavs in wav_dir, re-using those of
+        records whose file size and mtime did not change
+
+        # Returns
+            (records sorted by key, num of re-indexed files)
+    """
+    paths = glob.glob(os.path.join(wav_dir, '*.wav'))
+    prev = {}
+    if records is not None:
+        prev = dict((rec['path'], rec) for rec in records)
+    kept = []
+    todo = []
+    for path in paths:
+        rec = prev.get(path)
+        stat = os.stat(path)
+        if rec is not None and rec['size'] == stat.st_size and \
+           rec['mtime'] == stat.st_mtime and \
+           rec.get('met_mtime') == met_mtime(path):
+            kept.append(rec)
+        else:
+            todo.append(path)
+    if workers > 1 and len(todo) > 1:
+        pool = mp.Pool(workers)
+        new = pool.map(wav_record, todo)
+        pool.close()
+    else:
+        new = [wav_record(path) for path in todo]
+    return sorted(kept + new, key=lambda rec: rec['key']), len(new)
+
+
+class Manifest(object):
+    """ Records of the wavs (path, size, mtime, rate, length, key and
+        .met pesq/ssnr) in a clean and an optional noisy directory, paired by key and
+        cached as JSON so that only added or changed files are
+        re-indexed when it is refreshed.
+    """
+    def __init__(self, clean_dir, noisy_dir=None, path=None,
+                 workers=1, refresh=True, verbose=False):
+        self.clean_dir = clean_dir
+        self.noisy_dir = noisy_dir
+        self.path = path
+        self.verbose = verbose
+        cached = None
+        if path is not None and os.path.exists(path):
+            with open(path, 'r') as man_f:
+                cached = json.load(man_f)
+            if cached['clean_dir'] != clean_dir or \
+               cached['noisy_dir'] != noisy_dir:
+                # manifest of other dirs, build from scratch
+                cached = None
+        if cached is not None and not refresh:
+            self.clean = cached['clean']
+            self.noisy = cached['noisy']
+        else:
+            self.scan(cached, workers)
+        self.make_pairs()
+
+    def scan(self, cached, workers):
+        beg_t = timeit.default_timer()
+        if cached is None:
+            cached = {'clean':None, 'noisy':None}
+        self.clean, c_new = scan_wav_dir(self.clean_dir, cached['clean'],
+                                         workers)
+        n_new = 0
+        self.noisy = None
+        if self.noisy_dir is not None:
+            self.noisy, n_new = scan_wav_dir(self.noisy_dir,
+                                             cached['noisy'], workers)
+        changed = c_new + n_new > 0
+        if cached['clean'] is not None:
+            # files could have also been removed
+            changed = changed or len(cached['clean']) != len(self.clean)
+            if self.noisy is not None:
+                changed = changed or \
+                        len(cached['noisy']) != len(self.noisy)
+        if changed or cached['clean'] is None:
+            self.save()
+        end_t = timeit.default_timer()
+        if self.verbose:
+            print('Manifest of {}: re-indexed {} files in {} '
+                  's'.format(self.clean_dir, c_new + n_new, end_t - beg_t))
+
+    def save(self):
+        if self.path is None:
+            return
+        with open(self.path, 'w') as man_f:
+            man_f.write(json.dumps({'clean_dir':self.clean_dir,
+                                    'noisy_dir':self.noisy_dir,
+                                    'clean':self.clean,
+                                    'noisy':self.noisy}))
+
+    def make_pairs(self):
+        if self.noisy is None:
+            self.pairs = [(rec, None) for rec in self.clean]
+            return
+        noisy = dict((rec['key'], rec) for rec in self.noisy)
+        self.pairs = [(rec, noisy[rec['key']]) for rec in self.clean \
+                      if rec['key'] in noisy]
+        unpaired = len(self.clean) + len(self.noisy) - 2 * len(self.pairs)
+        if unpaired > 0:
+            print('WARNING: {} wavs in {} and {} without a '
+                  'pair'.format(unpaired, self.clean_dir, self.noisy_dir))
+
+    def fingerprint(self, max_pairs=None, **params):
+        """ Hash of the paired files contents (size and mtime) and the
+            params used to process them, identifying derived caches
+        """
+        pairs = self.pairs[:max_pairs]
+        files = []
+        for c_rec, n_rec in pairs:
+            files.append([c_rec['path'], c_rec['size'], c_rec['mtime']])
+            if n_rec is not None:
+                files.append([n_rec['path'], n_rec['size'], n_rec['mtime']])
+        desc = json.dumps([params, files], sort_keys=True)
+        return hashlib.sha1(desc.encode('utf-8')).hexdigest()
+
+    def paths(self, max_pairs=None):
+        """ Clean and noisy lists of paired paths """
+        pairs = self.pairs[:max_pairs]
+        c_paths = [c_rec['path'] for c_rec, _ in pairs]
+        n_paths = [n_rec['path'] for _, n_rec in pairs \
+                   if n_rec is not None]
+        return c_paths, n_paths
+
+    def lengths(self, max_pairs=None):
+        pairs = self.pairs[:max_pairs]
+        c_lens = [c_rec['length'] for c_rec, _ in pairs]
+        n_lens = [n_rec['length'] for _, n_rec in pairs \
+                  if n_rec is not None]
+        return c_lens, n_lens
+
+    def metrics(self, max_pairs=None):
+        """ PESQ and SSNR arrays of the noisy .met sidecars of each
+            pair, NaN where there is none
+        """
+        pairs = self.pairs[:max_pairs]
+        pesqs = np.full((len(pairs),), np.nan, dtype=np.float32)
+        ssnrs = np.full((len(pairs),), np.nan, dtype=np.float32)
+        for p_i, (_, n_rec) in enumerate(pairs):
+            if n_rec is not None and 'pesq' in n_rec:
+                pesqs[p_i] = n_rec['pesq']
+                ssnrs[p_i] = n_rec['ssnr']
+        return pesqs, ssnrs
+
+    def __len__(self):
+        return len(self.pairs)
@@ -0,0 +1,106 @@
+from __future__ import print_function
+import os
+import timeit
+import numpy as np
+import multiprocessing as mp
+import scipy.io.wavfile as wavfile
+
+
+def read_pcm16(path):
+    """ Read a 16-bit PCM wav as an int16 array, with no rescaling """
+    rate, wav = wavfile.read(path)
+    if wav.dtype != np.int16:
+        raise ValueError('Packed corpus needs 16-bit PCM wavs, found {} '
+                         'in {}'.format(wav.dtype, path))
+    if wav.ndim > 1:
+        raise ValueError('Packed corpus needs mono wavs: {}'.format(path))
+    return wav
+
+def pcm16_num_samples(path):
+    # memory-mapped read only parses the header, data is not decoded
+    return wavfile.read(path, mmap=True)[1].shape[0]
+
+def fill_packed_helper(args):
+    data_path, beg_i, load_fn, item = args
+    signal = load_fn(item)
+    data = np.load(data_path, mmap_mode='r+')
+    data[beg_i:beg_i + signal.shape[0]] = signal
+    data.flush()
+    del data
+    return signal.shape[0]
+
+def pack_signals(path, items, load_fn, lengths, dtype=np.int16,
+                 workers=1, verbose=False):
+    """ Concatenate 1-D signals into one memory-mapped array
+
+        # Arguments
+            path: output prefix, producing {path}.npy (data) and
+                  {path}.idx.npy (offsets, N + 1 int64 values)
+            items: list of arguments for load_fn, one per signal
+            load_fn: picklable function item -> 1-D numpy array
+            lengths: list with the length of each signal
+            dtype: data type stored on disk
+            workers: number of processes filling the array
+    """
+    assert len(items) == len(lengths), len(items)
+    beg_t = timeit.default_timer()
+    offsets = np.zeros((len(lengths) + 1,), dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    data_path = path + '.npy'
+    data = np.lib.format.open_memmap(data_path, mode='w+', dtype=dtype,
+                                     shape=(int(offsets[-1]),))
+    del data
+    # every worker writes its own region of the array
+    args = [(data_path, offsets[i], load_fn, item) for i, item in \
+            enumerate(items)]
+    if workers > 1:
+        pool = mp.Pool(workers)
+        filled = pool.map(fill_packed_helper, args)
+        pool.close()
+    else:
+        filled = [fill_packed_helper(arg) for arg in args]
+    for i, (fill_len, length) in enumerate(zip(filled, lengths)):
+        if fill_len != length:
+            raise ValueError('Signal {} packed with {} samples, expected '
+                             '{}'.format(items[i], fill_len, length))
+    # offsets are written last, so a half-built pack is never loaded
+    np.save(path + '.idx.npy', offsets)
+    end_t = timeit.default_timer()
+    if verbose:
+        print('Packed {} signals ({} samples) into {} in {} '
+              's'.format(len(items), offsets[-1], data_path, end_t - beg_t))
+    return PackedSignals(path)
+
+def packed_exists(path):
+    return os.path.exists(path + '.npy') and os.path.exists(path + '.idx.npy')
+
+
+class PackedSignals(object):
+    """ Read-only access to 1-D signals concatenated in a memory-mapped
+        array. Indexing returns a zero-copy view of one signal.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.offsets = np.load(path + '.idx.npy')
+        self._data = None
+
+    @property
+    def data(self):
+        # opened lazily, so that every DataLoader worker maps its own view
+        if self._data is None:
+            self._data = np.load(self.path + '.npy', mmap_mode='r')
+        return self._data
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_data'] = None
+        return state
+
+    def length(self, index):
+        return int(self.offsets[index + 1] - self.offsets[index])
+
+    def __getitem__(self, index):
+        return self.data[self.offsets[index]:self.offsets[index + 1]]
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
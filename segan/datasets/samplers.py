@@ -0,0 +1,178 @@
+import numpy as np
+from torch.utils.data.sampler import Sampler
+
+
+class UtteranceGroupSampler(Sampler):
+    """ Shuffled sampler that keeps together groups of slices from the
+        same utterance, so that a DataLoader worker building a batch
+        decodes each utterance once for group_size slices. Slices are
+        shuffled within their utterance, and groups are shuffled
+        across the whole dataset at every epoch.
+    """
+    def __init__(self, file_ids, group_size=4, seed=None):
+        self.file_ids = np.asarray(file_ids)
+        assert group_size > 0, group_size
+        self.group_size = group_size
+        self.rng = np.random.RandomState(seed)
+
+    def make_order(self):
+        file_ids = self.file_ids
+        n = file_ids.shape[0]
+        # shuffle slices, then gather them by utterance (stable sort)
+        perm = self.rng.permutation(n)
+        perm = perm[np.argsort(file_ids[perm], kind='mergesort')]
+        fids = file_ids[perm]
+        # rank of each slice within its utterance
+        new_utt = np.ones((n,), dtype=bool)
+        new_utt[1:] = fids[1:] != fids[:-1]
+        utt_beg = np.maximum.accumulate(np.where(new_utt, np.arange(n), 0))
+        rank = np.arange(n) - utt_beg
+        # groups of group_size slices of one utterance, randomly placed
+        new_group = new_utt | (rank % self.group_size == 0)
+        group_ids = np.cumsum(new_group) - 1
+        group_pos = self.rng.permutation(group_ids[-1] + 1 if n > 0 else 0)
+        return perm[np.lexsort((rank, group_pos[group_ids]))]
+
+    def __iter__(self):
+        return iter(self.make_order().tolist())
+
+    def __len__(self):
+        return self.file_ids.shape[0]
+
+
+class H5BlockSampler(Sampler):
+    """ Sampler of whole batches of indices, to be read by SEH5Dataset
+        with one HDF5 call each. If contiguous, every batch is a block of
+        consecutive rows starting at a shuffled block boundary; otherwise
+        it is a sorted random subset. Use it as the sampler of a
+        DataLoader with batch_size=1 and collate_fn=h5_block_collate.
+    """
+    def __init__(self, num_samples, batch_size, contiguous=True,
+                 shuffle=True, drop_last=False, seed=None):
+        self.num_samples = num_samples
+        self.batch_size = batch_size
+        self.contiguous = contiguous
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.rng = np.random.RandomState(seed)
+
+    def make_batches(self):
+        bsz = self.batch_size
+        if self.contiguous:
+            begs = np.arange(0, self.num_samples, bsz)
+            if self.shuffle:
+                begs = self.rng.permutation(begs)
+            order = [np.arange(beg, min(beg + bsz, self.num_samples)) \
+                     for beg in begs]
+        else:
+            perm = np.arange(self.num_samples)
+            if self.shuffle:
+                perm = self.rng.permutation(self.num_samples)
+            order = [np.sort(perm[beg:beg + bsz]) for beg in \
+                     range(0, self.num_samples, bsz)]
+        if self.drop_last:
+            order = [batch for batch in order if batch.shape[0] == bsz]
+        return order
+
+    def __iter__(self):
+        return iter([batch.tolist() for batch in self.make_batches()])
+
+    def __len__(self):
+        if self.drop_last:
+            return self.num_samples // self.batch_size
+        return (self.num_samples + self.batch_size - 1) // self.batch_size
+
+
+def padding_waste(lengths, batches):
+    """ Fraction of padded (zero) samples in the given batches, with
+        lengths [N] or [N, K] (e.g. src and trg lengths)
+    """
+    lengths = np.asarray(lengths).reshape((len(lengths), -1))
+    total = 0
+    real = 0
+    for batch in batches:
+        lens = lengths[batch]
+        total += lens.max(axis=0).sum() * lens.shape[0]
+        real += lens.sum()
+    if total == 0:
+        return 0.
+    return 1. - float(real) / total
+
+
+class BucketBatchSampler(Sampler):
+    """ Batch sampler grouping utterances of similar length, so that
+        little of a zero-padded batch is padding. Utterances are sorted
+        by length (shuffling those of equal length) and split greedily
+        into batches of up to batch_size, closing a batch early when its
+        padding fraction would exceed max_pad. Batches are shuffled at
+        every epoch, and the padding of the last one is in self.waste.
+    """
+    def __init__(self, lengths, batch_size, max_pad=0.1, shuffle=True,
+                 drop_last=False, seed=None):
+        # [N, K] lengths, e.g. src and trg, padded separately
+        self.lengths = np.asarray(lengths).reshape((len(lengths), -1))
+        self.batch_size = batch_size
+        self.max_pad = max_pad
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.rng = np.random.RandomState(seed)
+        self.waste = None
+        self.num_batches = len(self.make_batches(np.arange(len(lengths))))
+
+    def make_batches(self, perm):
+        lengths = self.lengths
+        order = perm[np.argsort(lengths[perm].sum(axis=1),
+                                kind='mergesort')[::-1]]
+        batches = []
+        batch = []
+        # longest first, so the batch max is the one of its first item
+        for idx in order:
+            if len(batch) > 0:
+                lens = lengths[batch + [idx]]
+                maxs = lens.max(axis=0)
+                pad = 1. - lens.sum() / float(maxs.sum() * lens.shape[0])
+                if len(batch) == self.batch_size or pad > self.max_pad:
+                    batches.append(batch)
+                    batch = []
+            batch.append(int(idx))
+        if len(batch) > 0 and (not self.drop_last or \
+                               len(batch) == self.batch_size):
+            batches.append(batch)
+        return batches
+
+    def __iter__(self):
+        n = self.lengths.shape[0]
+        if self.shuffle:
+            batches = self.make_batches(self.rng.permutation(n))
+            batches = [batches[i] for i in \
+                       self.rng.permutation(len(batches))]
+        else:
+            batches = self.make_batches(np.arange(n))
+        self.num_batches = len(batches)
+        self.waste = padding_waste(self.lengths, batches)
+        return iter(batches)
+
+    def __len__(self):
+        return self.num_batches
+
+
+class InfiniteSampler(Sampler):
+    """ Endless stream of the items of sampler, epoch after epoch (it
+        is re-iterated, thus re-shuffled, when exhausted). A DataLoader
+        over it never stops its iterator, so its workers stay alive and
+        keep prefetching across epochs. Its len is the one of an epoch.
+    """
+    def __init__(self, sampler):
+        self.sampler = sampler
+        self.epoch = 0
+
+    def __iter__(self):
+        if len(self.sampler) == 0:
+            return
+        while True:
+            for item in self.sampler:
+                yield item
+            self.epoch += 1
+
+    def __len__(self):
+        return len(self.sampler)
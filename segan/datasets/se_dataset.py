@@ -1,5 +1,6 @@
 from __future__ import print_function
 import torch
+import torch.nn.functional as F
 from torch.utils.data.dataset import Dataset
 from torch.utils.data.dataloader import default_collate
 import os
@@ -9,13 +10,22 @@ import gzip
 import pickle
 import timeit
 import scipy.io.wavfile as wavfile
+from scipy.signal import lfilter
 import numpy as np
 import multiprocessing as mp
 import random
 import librosa
+from collections import OrderedDict
+import soundfile as sf
 from ahoproc_tools.io import *
 from ahoproc_tools.interpolate import *
 import h5py
+try:
+    from packed import *
+    from manifest import *
+except ImportError:
+    from .packed import *
+    from .manifest import *
 
 
 def collate_fn(batch):
@@ -28,6 +38,66 @@ def collate_fn(batch):
     data_batch = default_collate(data_batch)
     return [uttname_batch] + data_batch
 
+class PooledCollate(object):
+    """ Collate of SE items (uttname, clean, noisy, ...) that writes the
+        clean and noisy slices into float32 [B, T] shared memory batches
+        recycled from a ring of pool_size buffers per shape and process,
+        instead of allocating (and sharing) new ones for every batch.
+        A batch is overwritten pool_size batches later, so pool_size
+        must cover the batches in flight per worker: the prefetch_factor
+        of the DataLoader, the one in use and the previous one, still
+        referenced while the next is fetched.
+        The returned clean and noisy tensors alias the pool (also in the
+        main process, and on CPU .to('cpu') or slicing keep aliasing):
+        anything held longer than that, e.g. fixed monitoring samples,
+        must be .clone()d. pin_memory or a copy to GPU already copy out.
+    """
+    def __init__(self, pool_size=4, prefetch_factor=2):
+        if pool_size < prefetch_factor + 2:
+            raise ValueError('pool_size {} < {}, the batches in flight per '
+                             'worker with a prefetch_factor of '
+                             '{}'.format(pool_size, prefetch_factor + 2,
+                                         prefetch_factor))
+        self.pool_size = pool_size
+        self.pools = {}
+        self.pool_idx = {}
+
+    def __getstate__(self):
+        # every worker process builds its own pool
+        state = self.__dict__.copy()
+        state['pools'] = {}
+        state['pool_idx'] = {}
+        return state
+
+    def buffer(self, key):
+        if key not in self.pools:
+            self.pools[key] = [torch.zeros(key[1:]).share_memory_() \
+                               for _ in range(self.pool_size)]
+            self.pool_idx[key] = 0
+        buf = self.pools[key][self.pool_idx[key]]
+        self.pool_idx[key] = (self.pool_idx[key] + 1) % self.pool_size
+        return buf
+
+    def __call__(self, batch):
+        shape = (len(batch),) + tuple(batch[0][1].shape)
+        c_batch = self.buffer(('clean',) + shape)
+        n_batch = self.buffer(('noisy',) + shape)
+        torch.stack([sample[1] for sample in batch], out=c_batch)
+        torch.stack([sample[2] for sample in batch], out=n_batch)
+        returns = [[sample[0] for sample in batch], c_batch, n_batch]
+        if len(batch[0]) > 3:
+            returns += default_collate([sample[3:] for sample in batch])
+        return returns
+
+def seed_worker(worker_id):
+    """ DataLoader worker_init_fn seeding numpy and random from the
+        torch seed of the worker, which derives from the main process
+        seed, so random augmentations are reproducible per worker
+    """
+    seed = torch.initial_seed() % 2 ** 32
+    np.random.seed(seed)
+    random.seed(seed)
+
 def slice_signal(signal, window_sizes, stride=0.5):
     """ Slice input signal
 
@@ -56,8 +126,24 @@ def slice_signal(signal, window_sizes, stride=0.5):
         slices[-1] = np.array(slices[-1], dtype=np.int32)
     return slices
 
-def slice_index_helper(args):
-    return slice_signal_index(*args)
+# one row per slice: wav pair id, clean/noisy begin sample, slice number
+SLICE_DTYPE = np.dtype([('file_id', np.int32), ('c_beg', np.int64),
+                        ('n_beg', np.int64), ('slice_idx', np.int32),
+                        ('activity', np.float32)])
+
+def wav_header_info(path):
+    """ Read (num_samples, rate) from the wav header, without decoding """
+    info = sf.info(path)
+    return info.frames, info.samplerate
+
+def slice_begins(n_samples, window_size, stride):
+    """ Begin sample of every full window_size slice of a signal with
+        n_samples, sliding in steps of stride * window_size
+    """
+    assert stride <= 1, stride
+    assert stride > 0, stride
+    offset = int(window_size * stride)
+    return np.arange(0, n_samples - window_size + 1, offset, dtype=np.int64)
 
 def slice_signal_index(path, window_size, stride):
     """ Slice input signal into indexes (beg, end) each
@@ -69,61 +155,179 @@ def slice_signal_index(path, window_size, stride):
         # Returns
             A list of tuples (beg, end) sample indexes
     """
-    signal, rate = librosa.load(path, 16000)
+    n_samples = wav_header_info(path)[0]
+    begs = slice_begins(n_samples, window_size, stride).tolist()
+    return [(beg_i, beg_i + window_size) for beg_i in begs]
+
+def make_slice_table(c_lens, n_lens, window_size, stride):
+    """ Vectorized slicing of wav pairs given their lengths in samples
+
+        # Returns
+            SLICE_DTYPE array with all the slices of every pair, pair
+            after pair, clipped to the shortest signal of each pair
+    """
     assert stride <= 1, stride
     assert stride > 0, stride
-    assert signal.ndim == 1, signal.ndim
-    n_samples = signal.shape[0]
-    slices = []
     offset = int(window_size * stride)
-    #for beg_i in range(0, n_samples - (offset), offset):
-    for beg_i in range(0, n_samples - window_size + 1, offset):
-        end_i = beg_i + window_size
-        #if end_i >= n_samples:
-            # last slice is offset to past to fit full window
-        #    beg_i = n_samples - window_size
-        #    end_i = n_samples
-        slice_ = (beg_i, end_i)
-        slices.append(slice_)
-    return slices
+    lens = np.minimum(np.asarray(c_lens, dtype=np.int64),
+                      np.asarray(n_lens, dtype=np.int64))
+    counts = np.maximum(0, (lens - window_size) // offset + 1)
+    if window_size < 1024:
+        # decimate less than 1024 samples window
+        counts[:] = 0
+    firsts = np.cumsum(counts) - counts
+    table = np.zeros((int(counts.sum()),), dtype=SLICE_DTYPE)
+    table['file_id'] = np.repeat(np.arange(lens.shape[0]), counts)
+    table['slice_idx'] = np.arange(table.shape[0]) - np.repeat(firsts, counts)
+    table['c_beg'] = table['slice_idx'].astype(np.int64) * offset
+    table['n_beg'] = table['c_beg']
+    table['activity'] = 1
+    return table
+
+def slice_activity_helper(args):
+    """ Fraction of active samples in each window_size slice of a wav
+        beginning at begs. A sample is active if its envelope (smoothed
+        as in P.56) is within activity_db of the peak envelope of the
+        utterance, or was so less than 0.2 s (hangover) before.
+    """
+    path, begs, window_size, activity_db = args
+    rate, wav = wavfile.read(path)
+    x = np.abs(wav.astype(np.float32))
+    g = np.exp(-1. / (rate * 0.03))
+    p = lfilter([1 - g], [1, -g], x)
+    q = lfilter([1 - g], [1, -g], p)
+    if q.max() <= 0:
+        return np.zeros((len(begs),), dtype=np.float32)
+    over = q >= q.max() * 10 ** (activity_db / 20.)
+    steps = np.arange(x.shape[0])
+    last_over = np.maximum.accumulate(np.where(over, steps, -1))
+    active = (last_over >= 0) & (steps - last_over <= np.ceil(rate * 0.2))
+    csum = np.concatenate(([0], np.cumsum(active)))
+    ends = np.minimum(begs + window_size, x.shape[0])
+    return ((csum[ends] - csum[begs]) / float(window_size)).astype(np.float32)
+
+# wavs are int16 on disk and float32 in memory: python float scalars
+# keep float32 arrays float32, while int arrays are cast explicitly
 
 def abs_normalize_wave_minmax(x):
     x = x.astype(np.int32)
     imax = np.max(np.abs(x))
-    x_n = x / imax
+    x_n = x.astype(np.float32) / np.float32(imax)
     return x_n 
 
 def abs_short_normalize_wave_minmax(x):
     imax = 32767.
-    x_n = x / imax
+    x_n = x.astype(np.float32) / imax
     return x_n 
 
 def dynamic_normalize_wave_minmax(x):
     x = x.astype(np.int32)
     imax = np.max(x)
     imin = np.min(x)
-    x_n = (x - np.min(x)) / (float(imax) - float(imin))
+    x_n = (x - np.min(x)).astype(np.float32) / (float(imax) - float(imin))
     return x_n * 2 - 1
 
 def normalize_wave_minmax(x):
+    x = np.asarray(x, dtype=np.float32)
     return (2./65535.) * (x - 32767.) + 1.
 
 def pre_emphasize(x, coef=0.95):
+    """ y[n] = x[n] - coef * x[n - 1] over the last axis of x ([T] or
+        [B, T]), keeping x[0]
+    """
     if coef <= 0:
         return x
-    x0 = np.reshape(x[0], (1,))
-    diff = x[1:] - coef * x[:-1]
-    concat = np.concatenate((x0, diff), axis=0)
-    return concat
+    x = np.asarray(x, dtype=np.float32)
+    y = np.empty_like(x)
+    y[..., 0] = x[..., 0]
+    y[..., 1:] = x[..., 1:] - coef * x[..., :-1]
+    return y
 
 def de_emphasize(y, coef=0.95):
+    """ Inverse of pre_emphasize, x[n] = coef * x[n - 1] + y[n] over the
+        last axis of y ([T] or [B, T]), as an IIR filter
+    """
     if coef <= 0:
         return y
-    x = np.zeros(y.shape[0], dtype=np.float32)
-    x[0] = y[0]
-    for n in range(1, y.shape[0], 1):
-        x[n] = coef * x[n - 1] + y[n]
-    return x
+    y = np.asarray(y, dtype=np.float32)
+    return lfilter(np.ones((1,), dtype=np.float32),
+                   np.array([1, -coef], dtype=np.float32), y, axis=-1)
+
+def torch_pre_emphasize(x, coef=0.95):
+    """ pre_emphasize of a [..., T] tensor, on its device """
+    if coef <= 0:
+        return x
+    return torch.cat((x[..., :1], x[..., 1:] - coef * x[..., :-1]), dim=-1)
+
+def torch_de_emphasize(y, coef=0.95, block_size=None):
+    """ de_emphasize of a [..., T] tensor, on its device. The recursion
+        runs within blocks as a product with a [K, K] matrix of powers
+        of coef, and sequentially only across the T / K blocks, carrying
+        the last sample of each one (K defaults to sqrt(T)).
+    """
+    if coef <= 0:
+        return y
+    T = y.size(-1)
+    K = block_size
+    if K is None:
+        K = max(1, int(np.ceil(np.sqrt(T))))
+    K = min(K, T)
+    pad = (K - T % K) % K
+    lead = y.shape[:-1]
+    y = F.pad(y.reshape(-1, 1, T), (0, pad)).view(-1, (T + pad) // K, K)
+    k = torch.arange(K, device=y.device, dtype=y.dtype)
+    # M[i, j] = coef ** (i - j) for j <= i
+    e = k.view(-1, 1) - k.view(1, -1)
+    M = torch.where(e >= 0, coef ** e.clamp(min=0),
+                    torch.zeros_like(e))
+    x = torch.matmul(y, M.t())
+    decay = coef ** (k + 1)
+    blocks = [x[:, 0]]
+    for n in range(1, x.size(1)):
+        blocks.append(x[:, n] + blocks[-1][:, -1:] * decay)
+    x = torch.cat(blocks, dim=-1)[:, :T]
+    return x.reshape(lead + (T,))
+
+class WavCache(object):
+    """ LRU cache of processed signals bounded by a budget of bytes.
+        Every DataLoader worker holds its own copy after forking.
+    """
+    def __init__(self, max_bytes, log_freq=0):
+        self.max_bytes = max_bytes
+        self.log_freq = log_freq
+        self.wavs = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, load_fn):
+        if key in self.wavs:
+            self.hits += 1
+            self.wavs.move_to_end(key)
+            wav = self.wavs[key]
+        else:
+            self.misses += 1
+            wav = load_fn(key)
+            self.put(key, wav)
+        if self.log_freq > 0 and (self.hits + self.misses) % \
+           self.log_freq == 0:
+            print('Wav cache (pid {}): {}'.format(os.getpid(), self.stats()))
+        return wav
+
+    def put(self, key, wav):
+        if wav.nbytes > self.max_bytes:
+            return
+        self.wavs[key] = wav
+        self.nbytes += wav.nbytes
+        while self.nbytes > self.max_bytes:
+            _, old_wav = self.wavs.popitem(last=False)
+            self.nbytes -= old_wav.nbytes
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits':self.hits, 'misses':self.misses,
+                'hit_rate':self.hits / max(lookups, 1),
+                'nbytes':self.nbytes, 'num_wavs':len(self.wavs)}
 
 class SEDataset(Dataset):
     """ Speech enhancement dataset """
@@ -131,21 +335,12 @@ class SEDataset(Dataset):
                  split='train', slice_size=2**14,
                  stride = 0.5, max_samples=None, do_cache=False, verbose=False,
                  slice_workers=2, preemph_norm=False,
-                 random_scale=[1]):
+                 random_scale=[1], packed=False, manifest=None,
+                 cache_bytes=0, additive=None, activity_db=None,
+                 min_activity=0.):
         super(SEDataset, self).__init__()
         print('Creating {} split out of data in {}'.format(split, clean_dir))
-        self.clean_names = glob.glob(os.path.join(clean_dir, '*.wav'))
-        self.noisy_names = glob.glob(os.path.join(noisy_dir, '*.wav'))
-        print('Found {} clean names and {} noisy'
-              ' names'.format(len(self.clean_names), len(self.noisy_names)))
         self.slice_workers = slice_workers
-        if len(self.clean_names) != len(self.noisy_names) or \
-           len(self.clean_names) == 0:
-            raise ValueError('No wav data found! Check your data path please')
-        if max_samples is not None:
-            assert isinstance(max_samples, int), type(max_samples)
-            self.clean_names = self.clean_names[:max_samples]
-            self.noisy_names = self.noisy_names[:max_samples]
         # path to store pairs of wavs
         self.cache_dir = cache_dir
         self.slice_size = slice_size
@@ -157,45 +352,147 @@ class SEDataset(Dataset):
         self.preemph_norm = preemph_norm
         # random scaling list, selected per utterance
         self.random_scale = random_scale
-        #self.read_wavs()
-        cache_path = cache_dir#os.path.join(cache_dir, '{}_chunks.pkl'.format(split))
-        #if os.path.exists(cache_path):
-        #    with open(cache_path ,'rb') as ch_f:
-        #        self.slicings = pickle.load(ch_f)
-        #else:
-        if not os.path.exists(cache_path):
-            os.makedirs(cache_path)
-        if not os.path.exists(os.path.join(cache_path,
-                                           '{}_idx2slice.pkl'.format(split))):
+        # read slices from memory-mapped packed corpus instead of wavs
+        self.packed = packed
+        # per slice speech activity of clean wavs, dropping slices below
+        # min_activity (activity_db None: not measured, all set to 1)
+        self.activity_db = activity_db
+        self.min_activity = min_activity
+        # noisy slices made on the fly by an Additive, from clean only
+        self.additive = additive
+        if additive is not None:
+            noisy_dir = None
+        self.noisy_dir = noisy_dir
+        # LRU of processed wavs, useful with an UtteranceGroupSampler
+        self.wav_cache = None
+        if cache_bytes > 0 and not packed:
+            self.wav_cache = WavCache(cache_bytes,
+                                      log_freq=10000 if verbose else 0)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        prefix = os.path.join(cache_dir, split)
+        if manifest is None:
+            # refreshed, re-indexing only added or changed wavs
+            manifest = Manifest(clean_dir, noisy_dir,
+                                prefix + '_manifest.json',
+                                workers=slice_workers, verbose=verbose)
+        elif not isinstance(manifest, Manifest):
+            manifest = Manifest(clean_dir, noisy_dir, manifest,
+                                workers=slice_workers, refresh=False,
+                                verbose=verbose)
+        self.manifest = manifest
+        if max_samples is not None:
+            assert isinstance(max_samples, int), type(max_samples)
+        self.max_samples = max_samples
+        self.clean_names, self.noisy_names = manifest.paths(max_samples)
+        if noisy_dir is None:
+            # noisy slices are mixed from the clean ones
+            self.noisy_names = self.clean_names
+        print('Found {} clean and noisy wav '
+              'pairs'.format(len(self.clean_names)))
+        if len(self.clean_names) == 0:
+            raise ValueError('No wav data found! Check your data path please')
+        # .met metrics of noisy wavs, indexed by file id
+        self.pesqs, self.ssnrs = manifest.metrics(max_samples)
+        # fingerprints of the cached slicing and packed corpus
+        self.cache_cfg_path = prefix + '_cache.json'
+        self.cache_cfg = {}
+        if os.path.exists(self.cache_cfg_path):
+            with open(self.cache_cfg_path, 'r') as cfg_f:
+                self.cache_cfg = json.load(cfg_f)
+        slices_fp = manifest.fingerprint(max_samples, slice_size=slice_size,
+                                         stride=stride,
+                                         activity_db=activity_db,
+                                         min_activity=min_activity)
+        if self.cache_cfg.get('slices') != slices_fp or \
+           not os.path.exists(prefix + '_slices.npy'):
             # make the slice indexes given slice_size and stride
             self.prepare_slicing()
-            #with open(os.path.join(cache_path, '{}_cache.cfg'.format(split)), 'w') as cfg_f:
-            #    cfg_f.write(json.dumps({'num_slicings':len(self.slicings)}))
-            with open(os.path.join(cache_path, '{}_idx2slice.pkl'.format(split)), 'wb') as i2s_f:
-                pickle.dump(self.idx2slice, i2s_f)
-            #if do_cache:
-            for s_i, slicing in self.slicings.items():
-                with open(os.path.join(cache_path, '{}_{}.pkl'.format(split, s_i)), 'wb') as ch_f:
-                    # store slicing results
-                    pickle.dump(slicing, ch_f)
-            self.num_samples = len(self.idx2slice)
-            self.slicings = None
-        else:
-            #with open(os.path.join(cache_path, '{}_cache.cfg'.format(split)), 'r') as cfg_f:
-            #    self.num_samples = json.load(cfg_f)
-            with open(os.path.join(cache_path, '{}_idx2slice.pkl'.format(split)), 'rb') as i2s_f:
-                self.idx2slice = pickle.load(i2s_f)
-            print('Loaded {} idx2slice items'.format(len(self.idx2slice)))
+            self.save_slicing()
+            self.update_cache_cfg('slices', slices_fp)
+        self.load_slicing()
+        if packed:
+            self.load_packed()
 
-    def read_wav_file(self, wavfilename):
-        rate, wav = wavfile.read(wavfilename)
+    def update_cache_cfg(self, key, fingerprint):
+        self.cache_cfg[key] = fingerprint
+        with open(self.cache_cfg_path, 'w') as cfg_f:
+            cfg_f.write(json.dumps(self.cache_cfg, indent=2))
+
+    def process_wav(self, wav):
         if self.preemph_norm:
             wav = pre_emphasize(wav, self.preemph)
             wav = normalize_wave_minmax(wav)
         else:
             wav = normalize_wave_minmax(wav)
             wav = pre_emphasize(wav, self.preemph)
-        return rate, wav
+        return wav
+
+    def read_wav_file(self, wavfilename):
+        rate, wav = wavfile.read(wavfilename)
+        return rate, self.process_wav(wav)
+
+    def read_cached_wav(self, wavfilename):
+        if self.wav_cache is None:
+            return self.read_wav_file(wavfilename)[1]
+        return self.wav_cache.get(wavfilename,
+                                  lambda path: self.read_wav_file(path)[1])
+
+    def read_wav_slice(self, wav, beg_i, end_i):
+        """ Process wav[beg_i:end_i] as read_wav_file does with the
+            full signal, keeping one past sample as pre-emphasis context
+        """
+        ctx = min(beg_i, 1)
+        wav = self.process_wav(wav[beg_i - ctx:end_i])
+        return wav[ctx:]
+
+    def save_slicing(self):
+        """ Store the slice table as {split}_slices.npy and the paths of
+            each wav pair, once per pair, in {split}_files.npz
+        """
+        prefix = os.path.join(self.cache_dir, self.split)
+        np.savez(prefix + '_files.npz', clean=np.array(self.c_paths),
+                 noisy=np.array(self.n_paths))
+        # table written last, as it flags the cache as complete
+        np.save(prefix + '_slices.npy', self.slice_table)
+
+    def load_slicing(self):
+        prefix = os.path.join(self.cache_dir, self.split)
+        # memory-mapped, pages are shared among DataLoader workers
+        self.slice_table = np.load(prefix + '_slices.npy', mmap_mode='r')
+        files = np.load(prefix + '_files.npz')
+        self.c_paths = files['clean']
+        self.n_paths = files['noisy']
+        print('Loaded {} slices of {} wav pairs'.format(len(self),
+                                                        len(self.c_paths)))
+
+    def load_packed(self):
+        """ Load the packed clean/noisy signals of this split, building
+            them first if needed
+        """
+        prefix = os.path.join(self.cache_dir, self.split)
+        packed_fp = self.manifest.fingerprint(self.max_samples)
+        keys = ['clean']
+        if self.noisy_dir is not None:
+            keys.append('noisy')
+        if self.cache_cfg.get('packed') != packed_fp or \
+           not all(packed_exists(prefix + '_' + key) for key in keys):
+            c_lens, n_lens = self.manifest.lengths(self.max_samples)
+            for key, paths, lengths in [('clean', self.c_paths, c_lens),
+                                        ('noisy', self.n_paths, n_lens)]:
+                if key not in keys:
+                    continue
+                pack_signals(prefix + '_' + key, list(paths), read_pcm16,
+                             lengths, workers=self.slice_workers,
+                             verbose=self.verbose)
+            self.update_cache_cfg('packed', packed_fp)
+        self.packed_clean = PackedSignals(prefix + '_clean')
+        self.packed_noisy = None
+        if self.noisy_dir is not None:
+            self.packed_noisy = PackedSignals(prefix + '_noisy')
+        if self.verbose:
+            print('Loaded packed corpus with {} '
+                  'files'.format(len(self.packed_clean)))
 
     def read_wavs(self):
         #self.clean_wavs = []
@@ -247,110 +544,125 @@ class SEDataset(Dataset):
                     print('Cached clean and wav pair into ', cache_path)
 
     def prepare_slicing(self):
-        """ Make a dictionary containing, for every wav file, its
-            slices performed sequentially in steps of stride and
-            sized slice_size
+        """ Make a table containing, for every wav pair, its slices
+            performed sequentially in steps of stride and sized
+            slice_size. Lengths come from the manifest wav headers.
         """
-        slicings = {}
-        idx2slice = []
         verbose = self.verbose
         if verbose:
             print('< Slicing all signals with window'
                   ' {} and stride {}... >'.format(self.slice_size, self.stride))
         beg_t = timeit.default_timer()
-        pool = mp.Pool(self.slice_workers)
-        clean_args = [(self.clean_names[i], self.slice_size, self.stride) for \
-                      i in range(len(self.clean_names))]
-        c_slices = pool.map(slice_index_helper, clean_args)
-        noisy_args = [(self.noisy_names[i], self.slice_size, self.stride) for \
-                      i in range(len(self.noisy_names))]
-        n_slices = pool.map(slice_index_helper, noisy_args)
-        if len(n_slices) != len(c_slices):
-            raise ValueError('n_slices and c_slices have different lengths:'
-                             '{} != {}'.format(len(n_slices), len(c_slices)))
-        for w_i, (c_slice, n_slice) in enumerate(zip(c_slices, n_slices)):
-            c_path = self.clean_names[w_i]
-            n_path = self.noisy_names[w_i]
-            if w_i not in slicings:
-                slicings[w_i] = []
-            for t_i, (c_ss, n_ss) in enumerate(zip(c_slice, n_slice)):
-                if c_ss[1] - c_ss[0] < 1024:
-                    # decimate less than 4096 samples window
-                    continue
-                slicings[w_i].append({'c_slice':c_ss,
-                                      'n_slice':n_ss, 'c_path':c_path,
-                                      'n_path':n_path,
-                                      'slice_idx':t_i})
-                idx2slice.append((w_i, t_i))
-        """
-        for w_i, (c_path, n_path) in enumerate(zip(self.clean_names,
-                                                   self.noisy_names)):
-            c_wav, rate = librosa.load(c_path)
-            n_wav, rate = librosa.load(n_path)
-            c_slices = slice_signal_index(c_wav, self.slice_size, self.stride)
-            n_slices = slice_signal_index(n_wav, self.slice_size, self.stride)
-            for c_slice, n_slice in zip(c_slices, n_slices):
-                if c_slice[1] - c_slice[0] < 4096:
-                    continue
-                if verbose:
-                    print('Id: {}, name: {}, c_slice: {}, n_slice: {}'.format(w_i, self.clean_names[w_i], c_slice,
-                                                                              n_slice))
-                slicings.append({'id':w_i, 'c_slice':c_slice,
-                                 'n_slice':n_slice,
-                                 'c_path':c_path,
-                                 'n_path':n_path})
-        """
-        self.slicings = slicings
-        self.idx2slice = idx2slice
+        c_lens, n_lens = self.manifest.lengths(self.max_samples)
+        if self.noisy_dir is None:
+            n_lens = c_lens
+        slice_table = make_slice_table(c_lens, n_lens,
+                                       self.slice_size, self.stride)
+        self.c_paths = self.clean_names
+        self.n_paths = self.noisy_names
+        if self.activity_db is not None and slice_table.shape[0] > 0:
+            # decode the clean wavs once, each one in a job
+            file_ids = slice_table['file_id']
+            bounds = np.flatnonzero(np.diff(file_ids)) + 1
+            args = [(self.c_paths[int(begs_f[0])], begs, self.slice_size,
+                     self.activity_db) for begs_f, begs in \
+                    zip(np.split(file_ids, bounds),
+                        np.split(slice_table['c_beg'], bounds))]
+            if self.slice_workers > 1:
+                pool = mp.Pool(self.slice_workers)
+                activities = pool.map(slice_activity_helper, args)
+                pool.close()
+            else:
+                activities = [slice_activity_helper(arg) for arg in args]
+            slice_table['activity'] = np.concatenate(activities)
+            keep = slice_table['activity'] >= self.min_activity
+            if verbose:
+                print('Dropped {}/{} slices with activity below '
+                      '{}'.format(int((~keep).sum()), keep.shape[0],
+                                  self.min_activity))
+            slice_table = slice_table[keep]
+        self.slice_table = slice_table
         end_t = timeit.default_timer()
         if verbose:
             print('Sliced all signals in {} s'.format(end_t - beg_t))
 
+    def fit_slices(self, c_slice, n_slice):
+        if n_slice.shape[0] > c_slice.shape[0]:
+            n_slice = n_slice[:c_slice.shape[0]]
+        if c_slice.shape[0] > n_slice.shape[0]:
+            c_slice = c_slice[:n_slice.shape[0]]
+        if c_slice.shape[0] < self.slice_size:
+            pad_t = np.zeros((self.slice_size - c_slice.shape[0],),
+                             dtype=c_slice.dtype)
+            c_slice = np.concatenate((c_slice, pad_t))
+            n_slice = np.concatenate((n_slice, pad_t))
+        return c_slice, n_slice
+
+    def mix_slice(self, f_i, c_beg):
+        """ Clean slice of file f_i and its noisy counterpart, adding
+            noise to the raw clean window (with its pre-emphasis context)
+            at the speech level of the whole utterance, before processing
+            both as read_wav_file does
+        """
+        ctx = min(c_beg, 1)
+        end_i = c_beg + self.slice_size
+        c_path = str(self.c_paths[f_i])
+        if self.packed:
+            wav = self.packed_clean[f_i]
+            raw = wav[c_beg - ctx:end_i]
+        else:
+            wav = None
+            raw = sf.read(c_path, start=c_beg - ctx, stop=end_i,
+                          dtype='int16')[0]
+        # P.56 level of the utterance, cached by the additive
+        level = self.additive.cached_level(c_path)
+        if level is None:
+            if wav is None:
+                wav = wavfile.read(c_path)[1]
+            utt = normalize_wave_minmax(wav)
+            if self.additive.do_IRS:
+                # level of the speech as mixed, in the handset band
+                utt = self.additive.apply_IRS(utt, 16000, 16)
+            level = self.additive.asl_P56(utt, 16000, 16, key=c_path)[0]
+        clean = torch.from_numpy(normalize_wave_minmax(raw)).unsqueeze(0)
+        noisy = self.additive.mix_batch(clean, levels=[level])[0][0]
+        # back to the raw scale, inverting normalize_wave_minmax
+        noisy = (noisy.numpy() - 1.) * (65535. / 2.) + 32767.
+        c_slice = self.process_wav(raw)[ctx:]
+        n_slice = self.process_wav(noisy)[ctx:]
+        return c_slice, n_slice
+
     def extract_slice(self, index):
         # load slice
-        s_i, e_i = self.idx2slice[index]
-        #print('selected item: ', s_i, e_i)
-        slice_file = os.path.join(self.cache_dir,
-                                  '{}_{}.pkl'.format(self.split, s_i))
-        #print('reading slice file: ', slice_file)
-        with open(slice_file, 'rb') as s_f:
-            slice_ = pickle.load(s_f)
-            #print('slice_: ', slice_)
-            slice_ = slice_[e_i]
-            c_slice_, n_slice_ = slice_['c_slice'], slice_['n_slice']
-            slice_idx = slice_['slice_idx']
-            n_path = slice_['n_path']
-            bname = os.path.splitext(os.path.basename(n_path))[0]
-            met_path = os.path.join(os.path.dirname(n_path), 
-                                    bname + '.met')
-            ssnr = None
-            pesq = None
-            if os.path.exists(met_path):
-                metrics = json.load(open(met_path, 'r'))
-                pesq = metrics['pesq']
-                ssnr = metrics['ssnr']
-            #c_signal, rate = librosa.load(slice_['c_path'])
-            #n_signal, rate = librosa.load(slice_['n_path'])
-            c_signal = self.read_wav_file(slice_['c_path'])[1]
-            n_signal = self.read_wav_file(slice_['n_path'])[1]
-            #c_signal = self.clean_wavs[idx_]
-            #n_signal = self.noisy_wavs[idx_]
-            c_slice = c_signal[c_slice_[0]:c_slice_[1]]
-            n_slice = n_signal[n_slice_[0]:n_slice_[1]]
-            if n_slice.shape[0] > c_slice.shape[0]:
-                n_slice = n_slice[:c_slice.shape[0]]
-            if c_slice.shape[0] > n_slice.shape[0]:
-                c_slice = c_slice[:n_slice.shape[0]]
-            #print('c_slice[0]: {} c_slice[1]: {}'.format(c_slice_[0],
-            #                                             c_slice_[1]))
-            if c_slice.shape[0] < self.slice_size:
-                pad_t = np.zeros((self.slice_size - c_slice.shape[0],))
-                c_slice = np.concatenate((c_slice, pad_t))
-                n_slice = np.concatenate((n_slice, pad_t))
-            #print('c_slice shape: ', c_slice.shape)
-            #print('n_slice shape: ', n_slice.shape)
-            bname = os.path.splitext(os.path.basename(n_path))[0]
-            return c_slice, n_slice, pesq, ssnr, slice_idx, bname
+        slice_ = self.slice_table[index]
+        f_i = int(slice_['file_id'])
+        c_beg = int(slice_['c_beg'])
+        n_beg = int(slice_['n_beg'])
+        slice_idx = int(slice_['slice_idx'])
+        n_path = str(self.n_paths[f_i])
+        pesq = None
+        ssnr = None
+        if not np.isnan(self.pesqs[f_i]):
+            pesq = float(self.pesqs[f_i])
+            ssnr = float(self.ssnrs[f_i])
+        if self.additive is not None:
+            c_slice, n_slice = self.mix_slice(f_i, c_beg)
+        elif self.packed:
+            c_slice = self.read_wav_slice(self.packed_clean[f_i], c_beg,
+                                          c_beg + self.slice_size)
+            n_slice = self.read_wav_slice(self.packed_noisy[f_i], n_beg,
+                                          n_beg + self.slice_size)
+        else:
+            c_signal = self.read_cached_wav(str(self.c_paths[f_i]))
+            n_signal = self.read_cached_wav(n_path)
+            c_slice = c_signal[c_beg:c_beg + self.slice_size]
+            n_slice = n_signal[n_beg:n_beg + self.slice_size]
+        c_slice, n_slice = self.fit_slices(c_slice, n_slice)
+        bname = os.path.splitext(os.path.basename(n_path))[0]
+        if self.additive is not None:
+            # tagged as additive noisy, e.g. for the WSEGAN den_loss mask
+            bname += '_additive'
+        return c_slice, n_slice, pesq, ssnr, slice_idx, bname
 
     def __getitem__(self, index):
         c_slice, n_slice, pesq, ssnr, slice_idx, bname = self.extract_slice(index)
@@ -368,13 +680,14 @@ class SEDataset(Dataset):
         return returns
 
     def __len__(self):
-        return len(self.idx2slice)
+        return self.slice_table.shape[0]
 
 class RandomChunkSEDataset(Dataset):
     """ Random Chunking Speech enhancement dataset """
     def __init__(self, clean_dir, noisy_dir, preemph, 
                  split='train', slice_size=2**14,
-                 max_samples=None, utt2spk=None, spk2idx=None):
+                 max_samples=None, utt2spk=None, spk2idx=None,
+                 manifest=None):
         super(RandomChunkSEDataset, self).__init__()
         print('Creating {} split out of data in {}'.format(split, clean_dir))
         self.preemph = preemph
@@ -388,11 +701,28 @@ class RandomChunkSEDataset(Dataset):
             self.read_utt2spk()
         self.samples = {}
         self.slice_size = slice_size
-        self.clean_names = glob.glob(os.path.join(clean_dir, '*.wav'))
-        for c_i, cname in enumerate(self.clean_names):
-            bname = os.path.basename(cname)
+        if manifest is not None:
+            # paired clean/noisy records instead of globbing the dirs
+            if not isinstance(manifest, Manifest):
+                manifest = Manifest(clean_dir, noisy_dir, manifest,
+                                    refresh=False)
+            self.clean_names, noisy_names = manifest.paths(max_samples)
+        else:
+            self.clean_names = glob.glob(os.path.join(clean_dir, '*.wav'))
+            noisy_names = [os.path.join(noisy_dir, os.path.basename(cname)) \
+                           for cname in self.clean_names]
+        self.manifest = manifest
+        for c_i, (cname, nname) in enumerate(zip(self.clean_names,
+                                                 noisy_names)):
             self.samples[c_i] = {'clean':cname,
-                                 'noisy':os.path.join(noisy_dir, bname)}
+                                 'noisy':nname}
+            if manifest is not None:
+                # headers already read by the manifest: (length, rate)
+                c_rec, n_rec = manifest.pairs[c_i]
+                self.samples[c_i]['clean_info'] = (c_rec['length'],
+                                                   c_rec['rate'])
+                self.samples[c_i]['noisy_info'] = (n_rec['length'],
+                                                   n_rec['rate'])
 
     def read_utt2spk(self):
         utt2spk = {}
@@ -405,34 +735,67 @@ class RandomChunkSEDataset(Dataset):
 
     def read_wav_file(self, wavfilename):
         #rate, wav = wavfile.read(wavfilename)
-        wav, rate = librosa.load(wavfilename, 16000)
+        wav, rate = librosa.load(wavfilename, sr=16000)
 
         #wav = abs_short_normalize_wave_minmax(wav)
         wav = pre_emphasize(wav, self.preemph)
         return rate, wav
 
+    def read_wav_window(self, wavfilename, beg_i, end_i):
+        """ Read wav[beg_i:end_i] of a 16kHz wav as read_wav_file does,
+            seeking to the window plus one past sample of pre-emphasis
+            context instead of decoding the whole file
+        """
+        ctx = min(beg_i, 1)
+        wav, rate = sf.read(wavfilename, start=beg_i - ctx, stop=end_i,
+                            dtype='float32')
+        if wav.ndim > 1:
+            # downmix as librosa.load does
+            wav = np.mean(wav, axis=1)
+        wav = pre_emphasize(wav, self.preemph)
+        return wav[ctx:]
+
+    def wav_info(self, sample, key):
+        if key + '_info' in sample:
+            return sample[key + '_info']
+        return wav_header_info(sample[key])
+
     def __getitem__(self, index):
         sample = self.samples[index]
         cpath = sample['clean']
         bname = os.path.splitext(os.path.basename(cpath))[0]
         npath = sample['noisy']
         returns = [bname]
-        # slice them randomly
-        cwav = self.read_wav_file(cpath)[1]
-        nwav = self.read_wav_file(npath)[1]
-        min_L = min(cwav.shape[0], nwav.shape[0])
+        # pick the random window from the headers, then read only it
+        c_len, c_rate = self.wav_info(sample, 'clean')
+        n_len, n_rate = self.wav_info(sample, 'noisy')
+        if c_rate != 16000 or n_rate != 16000:
+            # needs resampling the whole signal
+            cwav = self.read_wav_file(cpath)[1]
+            nwav = self.read_wav_file(npath)[1]
+            c_len = cwav.shape[0]
+            n_len = nwav.shape[0]
+        min_L = min(c_len, n_len)
         if self.slice_size > min_L:
             slice_size = min_L
         else:
             slice_size = self.slice_size
         slice_idx = random.randint(0, min_L - slice_size)
-        cslice = cwav[slice_idx:slice_idx + self.slice_size] 
-        nslice = nwav[slice_idx:slice_idx + self.slice_size] 
+        if c_rate != 16000 or n_rate != 16000:
+            cslice = cwav[slice_idx:slice_idx + self.slice_size]
+            nslice = nwav[slice_idx:slice_idx + self.slice_size]
+        else:
+            cslice = self.read_wav_window(cpath, slice_idx,
+                                          min(slice_idx + self.slice_size,
+                                              c_len))
+            nslice = self.read_wav_window(npath, slice_idx,
+                                          min(slice_idx + self.slice_size,
+                                              n_len))
         if min_L < self.slice_size:
             c_pad_size = self.slice_size - cslice.shape[0]
             n_pad_size = self.slice_size - nslice.shape[0]
-            c_pad_T = np.zeros(c_pad_size,)
-            n_pad_T = np.zeros(n_pad_size,)
+            c_pad_T = np.zeros(c_pad_size, dtype=np.float32)
+            n_pad_T = np.zeros(n_pad_size, dtype=np.float32)
             # pad to desired size
             cslice  = np.concatenate((cslice, c_pad_T), axis=0)
             nslice  = np.concatenate((nslice, n_pad_T), axis=0)
@@ -447,12 +810,39 @@ class RandomChunkSEDataset(Dataset):
     def __len__(self):
         return len(self.samples)
 
+def read_interp_f0(path):
+    """ Interpolated lf0 and uv flags of an .lf0 file, each with a
+        trailing zero to show EOS
+    """
+    lf0 = read_aco_file(path)
+    ilf0, uv = interpolation(lf0, -10000000000)
+    ilf0 = ilf0.astype(np.float32)
+    uv = uv.astype(np.float32)
+    ilf0[ilf0 < -1000] = np.log(60)
+    # append zeros in the end to show EOS
+    ilf0 = np.concatenate((ilf0, np.zeros((1,), dtype=ilf0.dtype)), axis=0)
+    uv = np.concatenate((uv, np.zeros((1,), dtype=uv.dtype)), axis=0)
+    return ilf0, uv
+
+def read_interp_lf0(path):
+    return read_interp_f0(path)[0]
+
+def read_interp_uv(path):
+    return read_interp_f0(path)[1]
+
+def f0_wav_peak_helper(args):
+    # peak used by abs_normalize_wave_minmax over the whole wav
+    path, preemph = args
+    wav = pre_emphasize(read_pcm16(path), preemph).astype(np.int32)
+    return int(np.max(np.abs(wav)))
+
 class RandomChunkSEF0Dataset(Dataset):
     """ Random Chunking Speech enhancement dataset loading
         F0 curves from aco path rather than wavs """
     def __init__(self, clean_dir, noisy_dir, preemph=0, 
                  split='train', slice_size=2**14,
-                 max_samples=None):
+                 max_samples=None, cache_dir='.', packed=False,
+                 workers=2, verbose=False):
         super(RandomChunkSEF0Dataset, self).__init__()
         print('Creating {} split out of data in {}'.format(split, clean_dir))
         self.preemph = preemph
@@ -460,12 +850,92 @@ class RandomChunkSEF0Dataset(Dataset):
         # dict containing mapping spkid --> int idx
         self.samples = {}
         self.slice_size = slice_size
-        self.clean_names = glob.glob(os.path.join(clean_dir, '*.wav'))
+        self.cache_dir = cache_dir
+        self.split = split
+        # slice wavs and F0 from a memory-mapped store instead of files
+        self.packed = packed
+        self.workers = workers
+        self.verbose = verbose
+        if packed:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            self.manifest = Manifest(clean_dir,
+                                     path=os.path.join(cache_dir, split) + \
+                                     '_f0_manifest.json',
+                                     workers=workers, verbose=verbose)
+            self.clean_names = self.manifest.paths(max_samples)[0]
+        else:
+            self.clean_names = glob.glob(os.path.join(clean_dir, '*.wav'))
         for c_i, cname in enumerate(self.clean_names):
             bname = os.path.splitext(os.path.basename(cname))[0]
             self.samples[c_i] = {'clean':cname,
                                  'noisy':os.path.join(noisy_dir, bname) + \
                                  '.lf0'}
+        if packed:
+            self.max_samples = max_samples
+            self.load_packed()
+
+    def load_packed(self):
+        """ Load the store of clean wavs (int16, with the peak of each
+            normalized wav) and interpolated lf0/uv curves, building it
+            first if needed
+        """
+        prefix = os.path.join(self.cache_dir, self.split) + '_f0'
+        cfg_path = prefix + '_cache.json'
+        c_paths = [sample['clean'] for sample in self.samples.values()]
+        f0_paths = [sample['noisy'] for sample in self.samples.values()]
+        f0_files = []
+        for f0_path in f0_paths:
+            stat = os.stat(f0_path)
+            f0_files.append([f0_path, stat.st_size, stat.st_mtime])
+        packed_fp = self.manifest.fingerprint(self.max_samples,
+                                              preemph=self.preemph,
+                                              f0_files=f0_files)
+        cfg = {}
+        if os.path.exists(cfg_path):
+            with open(cfg_path, 'r') as cfg_f:
+                cfg = json.load(cfg_f)
+        if cfg.get('packed') != packed_fp or \
+           not os.path.exists(prefix + '_peaks.npy') or \
+           not packed_exists(prefix + '_wav') or \
+           not packed_exists(prefix + '_lf0') or \
+           not packed_exists(prefix + '_uv'):
+            c_lens = self.manifest.lengths(self.max_samples)[0]
+            # aco files are raw float32 frames, plus the EOS frame
+            f0_lens = [f[1] // 4 + 1 for f in f0_files]
+            pack_signals(prefix + '_wav', c_paths, read_pcm16, c_lens,
+                         workers=self.workers, verbose=self.verbose)
+            pack_signals(prefix + '_lf0', f0_paths, read_interp_lf0, f0_lens,
+                         dtype=np.float32, workers=self.workers,
+                         verbose=self.verbose)
+            pack_signals(prefix + '_uv', f0_paths, read_interp_uv, f0_lens,
+                         dtype=np.float32, workers=self.workers,
+                         verbose=self.verbose)
+            args = [(c_path, self.preemph) for c_path in c_paths]
+            if self.workers > 1:
+                pool = mp.Pool(self.workers)
+                peaks = pool.map(f0_wav_peak_helper, args)
+                pool.close()
+            else:
+                peaks = [f0_wav_peak_helper(arg) for arg in args]
+            np.save(prefix + '_peaks.npy', np.array(peaks, dtype=np.int64))
+            cfg['packed'] = packed_fp
+            with open(cfg_path, 'w') as cfg_f:
+                cfg_f.write(json.dumps(cfg, indent=2))
+        self.packed_wav = PackedSignals(prefix + '_wav')
+        self.packed_lf0 = PackedSignals(prefix + '_lf0')
+        self.packed_uv = PackedSignals(prefix + '_uv')
+        self.peaks = np.load(prefix + '_peaks.npy')
+
+    def read_packed_window(self, index, beg_i, end_i):
+        """ Read wav[beg_i:end_i] of the packed wav index as
+            read_wav_file does with the full signal
+        """
+        ctx = min(beg_i, 1)
+        wav = self.packed_wav[index][beg_i - ctx:end_i]
+        wav = pre_emphasize(wav, self.preemph)[ctx:]
+        return wav.astype(np.int32).astype(np.float32) / \
+                np.float32(self.peaks[index])
 
     def read_wav_file(self, wavfilename):
         rate, wav = wavfile.read(wavfilename)
@@ -481,30 +951,31 @@ class RandomChunkSEF0Dataset(Dataset):
         npath = sample['noisy']
         returns = [bname]
         # slice them randomly
-        cwav = self.read_wav_file(cpath)[1]
-        lf0 = read_aco_file(npath)
-        ilf0, uv = interpolation(lf0, -10000000000)
-        ilf0[ilf0 < -1000] = np.log(60)
-        # append zeros in the end to show EOS
-        ilf0 = np.concatenate((ilf0, np.zeros((1,))), axis=0)
-        uv = np.concatenate((uv, np.zeros((1,))), axis=0)
-        min_L = cwav.shape[0]
+        if self.packed:
+            min_L = self.packed_wav.length(index)
+            ilf0 = self.packed_lf0[index]
+            uv = self.packed_uv[index]
+        else:
+            cwav = self.read_wav_file(cpath)[1]
+            ilf0, uv = read_interp_f0(npath)
+            min_L = cwav.shape[0]
         #min_L = lf0.shape[0] * 80
-        #print('cwav shape: ', cwav.shape)
-        cwav = cwav[:min_L]
-        #print('trimmed cwav shape: ', cwav.shape)
         if self.slice_size > min_L:
             slice_size = min_L
         else:
             slice_size = self.slice_size
         slice_idx = random.randint(0, min_L - slice_size)
-        cslice = cwav[slice_idx:slice_idx + self.slice_size] 
+        if self.packed:
+            cslice = self.read_packed_window(index, slice_idx,
+                                             slice_idx + self.slice_size)
+        else:
+            cslice = cwav[slice_idx:slice_idx + self.slice_size] 
         #print('slice_idx: ', slice_idx)
         #print('slice_idx // 80: ', slice_idx // 80)
         if slice_size < self.slice_size:
-            print('WARNING: cwav shape: ', cwav.shape[0])
-        lf0slice = np.zeros(((self.slice_size // 80) + 1,))
-        uvslice = np.zeros(((self.slice_size // 80) + 1,))
+            print('WARNING: cwav shape: ', min_L)
+        lf0slice = np.zeros(((self.slice_size // 80) + 1,), dtype=np.float32)
+        uvslice = np.zeros(((self.slice_size // 80) + 1,), dtype=np.float32)
         ilf0_s = ilf0[(slice_idx // 80):(slice_idx // 80) + \
                       (self.slice_size // 80) + 1]
         uv_s = uv[(slice_idx // 80):(slice_idx // 80) + \
@@ -513,7 +984,7 @@ class RandomChunkSEF0Dataset(Dataset):
         uvslice[:uv_s.shape[0]] = uv_s
         if min_L < self.slice_size:
             c_pad_size = self.slice_size - cslice.shape[0]
-            c_pad_T = np.zeros(c_pad_size,)
+            c_pad_T = np.zeros(c_pad_size, dtype=np.float32)
             # pad to desired size
             cslice  = np.concatenate((cslice, c_pad_T), axis=0)
         returns += [torch.FloatTensor(cslice), 
@@ -524,48 +995,127 @@ class RandomChunkSEF0Dataset(Dataset):
     def __len__(self):
         return len(self.samples)
 
+def h5_block_collate(batch):
+    # blocks of an SEH5Dataset come already batched, one per DataLoader item
+    return batch[0]
+
 class SEH5Dataset(Dataset):
     """ Speech enhancement dataset from H5 data file. 
         The pairs must be named (data, label), being each
         one a dataset containing wav chunks (already chunked
         to fixed size).
+        The file is opened lazily by every DataLoader worker, and
+        indexing with a list of indices (e.g. from an H5BlockSampler)
+        reads the whole batch with one HDF5 call per dataset.
     """
     def __init__(self, data_root, split, preemph, 
                  verbose=False,
                  preemph_norm=False,
-                 random_scale=[1]):
+                 random_scale=[1],
+                 chunk_cache_bytes=None,
+                 chunk_cache_slots=None):
         super().__init__()
         self.data_root = data_root
         self.split = split
         self.preemph = preemph
         self.verbose = verbose
         self.random_scale = random_scale
+        # HDF5 chunk cache of every open handle (None: h5py default)
+        self.chunk_cache_bytes = chunk_cache_bytes
+        self.chunk_cache_slots = chunk_cache_slots
         h5_file = os.path.join(data_root, split + '.h5')
         if not os.path.exists(h5_file):
             raise FileNotFoundError(h5_file)
-        f = h5py.File(h5_file, 'r')
-        ks = list(f.keys())
-        assert 'data' in ks, ks
-        assert 'label' in ks, ks
+        self.h5_file = h5_file
+        with h5py.File(h5_file, 'r') as f:
+            ks = list(f.keys())
+            assert 'data' in ks, ks
+            assert 'label' in ks, ks
+            self.num_samples = f['data'].shape[0]
+            # names and slice indexes written by make_h5.py, if any
+            self.uttnames = None
+            self.slice_idxs = None
+            if 'uttname' in ks:
+                # one fixed width bytes array, not a list of str objects
+                # copied by every worker, decoded on access
+                self.uttnames = np.array([name.encode('utf-8') \
+                                          if isinstance(name, str) else name \
+                                          for name in f['uttname'][:]],
+                                         dtype=np.bytes_)
+                self.slice_idxs = f['slice_idx'][:]
         if verbose:
             print('Found H5 file {} with {} samples'.format(h5_file,
-                                                            f['data'].shape[0]))
-        self.f = f
+                                                            self.num_samples))
+        self._f = None
+        self._pid = None
+
+    @property
+    def f(self):
+        # a handle per process, never shared by forked workers
+        if self._f is None or self._pid != os.getpid():
+            kwargs = {}
+            if self.chunk_cache_bytes is not None:
+                kwargs['rdcc_nbytes'] = self.chunk_cache_bytes
+            if self.chunk_cache_slots is not None:
+                kwargs['rdcc_nslots'] = self.chunk_cache_slots
+            self._f = h5py.File(self.h5_file, 'r', **kwargs)
+            self._pid = os.getpid()
+        return self._f
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_f'] = None
+        state['_pid'] = None
+        return state
+
+    def read_block(self, indexes):
+        """ Read the rows of indexes (sorted, as HDF5 needs increasing
+            indices) with one call per dataset, or a slice if contiguous
+        """
+        indexes = np.sort(np.asarray(indexes, dtype=np.int64))
+        if indexes[-1] - indexes[0] + 1 == indexes.shape[0]:
+            sel = slice(int(indexes[0]), int(indexes[-1]) + 1)
+        else:
+            sel = indexes
+        c_block = self.f['data'][sel]
+        n_block = self.f['label'][sel]
+        rscales = np.array([random.choice(self.random_scale) \
+                            for _ in range(indexes.shape[0])])
+        if np.any(rscales != 1):
+            rscales = rscales.reshape((-1,) + (1,) * (c_block.ndim - 1))
+            c_block = rscales * c_block
+            n_block = rscales * n_block
+        if self.uttnames is None:
+            # uttname not known with H5
+            return [['N/A'] * indexes.shape[0],
+                    torch.FloatTensor(c_block).squeeze(-1),
+                    torch.FloatTensor(n_block).squeeze(-1),
+                    torch.zeros(indexes.shape[0]).long()]
+        return [[self.uttnames[i].decode('utf-8') for i in indexes],
+                torch.FloatTensor(c_block).squeeze(-1),
+                torch.FloatTensor(n_block).squeeze(-1),
+                torch.LongTensor(self.slice_idxs[indexes].astype(np.int64))]
 
     def __getitem__(self, index):
+        if isinstance(index, (list, tuple, np.ndarray)):
+            return self.read_block(index)
         c_slice = self.f['data'][index]
         n_slice = self.f['label'][index]
         rscale = random.choice(self.random_scale)
         if rscale != 1:
             c_slice = rscale * c_slice
             n_slice = rscale * n_slice
-        # uttname not known with H5
-        returns = ['N/A', torch.FloatTensor(c_slice).squeeze(-1), 
-                   torch.FloatTensor(n_slice).squeeze(-1), 0]
+        uttname = 'N/A'
+        slice_idx = 0
+        if self.uttnames is not None:
+            uttname = self.uttnames[index].decode('utf-8')
+            slice_idx = int(self.slice_idxs[index])
+        returns = [uttname, torch.FloatTensor(c_slice).squeeze(-1), 
+                   torch.FloatTensor(n_slice).squeeze(-1), slice_idx]
         return returns
 
     def __len__(self):
-        return self.f['data'].shape[0]
+        return self.num_samples
 
 if __name__ == '__main__':
     #dset = SEDataset('../../data/clean_trainset', '../../data/noisy_trainset', 0.95,
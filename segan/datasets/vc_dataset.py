@@ -1,58 +1,88 @@
 import torch
 from torch.utils.data import Dataset
 from scipy.io import wavfile
+import numpy as np
 import glob
 import os
 try:
     from se_dataset import normalize_wave_minmax, pre_emphasize
+    from se_dataset import wav_header_info
+    from manifest import Manifest
 except ImportError:
     from .se_dataset import normalize_wave_minmax, pre_emphasize
+    from .se_dataset import wav_header_info
+    from .manifest import Manifest
 
 
-def varlen_wav_collate(batch):
-    src_maxlen = 0
-    trg_maxlen = 0
-    for sample in batch:
-        if len(sample) == 3:
-            _, src, trg = sample
-        else:
-            src, trg = sample
-        if src_maxlen < src.shape[0]:
-            src_maxlen = src.shape[0]
-        if trg_maxlen < trg.shape[0]:
-            trg_maxlen = trg.shape[0]
-    src_wav_b = torch.zeros(len(batch), 
-                            src_maxlen)
-    trg_wav_b = torch.zeros(len(batch), 
-                            trg_maxlen)
-    for bi, sample in enumerate(batch):
-        if len(sample) == 3:
-            _, src, trg = sample
-        else:
-            src, trg = sample
-        src_wav_b[bi, :src.shape[0]] = torch.FloatTensor(src)
-        trg_wav_b[bi, :trg.shape[0]] = torch.FloatTensor(trg)
-    return '', src_wav_b, trg_wav_b
+def varlen_wav_collate(batch, lengths=False):
+    """ Zero-pad the (src, trg) wavs of a batch to the longest of each
+
+        # Arguments
+            batch: list of (src, trg) or (name, src, trg) samples
+            lengths: also return the LongTensors of src and trg lengths
+    """
+    if len(batch[0]) == 3:
+        batch = [sample[1:] for sample in batch]
+    src_lens = np.array([src.shape[0] for src, _ in batch], dtype=np.int64)
+    trg_lens = np.array([trg.shape[0] for _, trg in batch], dtype=np.int64)
+    # filled in place, each wav is cast and copied once
+    src_wav_b = np.zeros((len(batch), src_lens.max()), dtype=np.float32)
+    trg_wav_b = np.zeros((len(batch), trg_lens.max()), dtype=np.float32)
+    for bi, (src, trg) in enumerate(batch):
+        src_wav_b[bi, :src.shape[0]] = src
+        trg_wav_b[bi, :trg.shape[0]] = trg
+    returns = ['', torch.from_numpy(src_wav_b), torch.from_numpy(trg_wav_b)]
+    if lengths:
+        returns += [torch.from_numpy(src_lens), torch.from_numpy(trg_lens)]
+    return tuple(returns)
+
+def varlen_wav_collate_lens(batch):
+    return varlen_wav_collate(batch, lengths=True)
+
+def length_mask(lens, max_len=None):
+    """ [B, max_len] float mask, 1 where t < lens[b] """
+    if max_len is None:
+        max_len = int(lens.max())
+    steps = torch.arange(max_len, dtype=lens.dtype, device=lens.device)
+    return (steps.unsqueeze(0) < lens.unsqueeze(1)).float()
 
 class VCDataset(Dataset):
     """
     At the moment JUST ONE-TO-ONE SPEAKER MAPPING
     """
     # TODO: EXTEND TO MULTI SPK LOAD
-    def __init__(self, src_path, trg_path, preemph=0):
+    def __init__(self, src_path, trg_path, preemph=0, manifest=None):
         super().__init__()
         self.src_path = src_path
         self.trg_path = trg_path
         self.preemph = preemph
-        src_files = glob.glob(os.path.join(src_path, '*.wav'))
-        trg_files = []
-        for src_file in src_files:
-            bname = os.path.basename(src_file)
-            trg_file = os.path.join(trg_path, bname)
-            assert os.path.exists(trg_file)
-            trg_files.append(trg_file)
+        if manifest is not None:
+            # src/trg records paired by basename
+            if not isinstance(manifest, Manifest):
+                manifest = Manifest(src_path, trg_path, manifest,
+                                    refresh=False)
+            src_files, trg_files = manifest.paths()
+        else:
+            src_files = glob.glob(os.path.join(src_path, '*.wav'))
+            trg_files = []
+            for src_file in src_files:
+                bname = os.path.basename(src_file)
+                trg_file = os.path.join(trg_path, bname)
+                assert os.path.exists(trg_file)
+                trg_files.append(trg_file)
+        self.manifest = manifest
         self.src_files = src_files
         self.trg_files = trg_files
+        # lengths from the headers, to bucket batches without decoding
+        if manifest is not None:
+            src_lens, trg_lens = manifest.lengths()
+        else:
+            src_lens = [wav_header_info(src_file)[0] \
+                        for src_file in src_files]
+            trg_lens = [wav_header_info(trg_file)[0] \
+                        for trg_file in trg_files]
+        self.src_lens = np.array(src_lens, dtype=np.int64)
+        self.trg_lens = np.array(trg_lens, dtype=np.int64)
 
     def read_wav_file(self, wavfilename):
         rate, wav = wavfile.read(wavfilename)
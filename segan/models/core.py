@@ -7,6 +7,11 @@ import torch.nn.functional as F
 import os
 import math
 import json
+import contextlib
+import functools
+import inspect
+from torch.utils.checkpoint import checkpoint
+from torch.nn.utils.spectral_norm import SpectralNorm
 
 class Saver(object):
 
@@ -151,6 +156,126 @@ class Saver(object):
             self.optimizer.load_state_dict(st_dict['optimizer'])
 
 
+class MixedPrecision(object):
+    """ Autocast and gradient scaling of a train loop: float16 with a
+        dynamic loss scale on cuda, bfloat16 (same exponent range as
+        float32, so no scaling) on cpu. Weights, optimizer states and
+        reductions stay in float32. If not enabled, or torch has no
+        autocast, everything runs in float32 as before.
+    """
+    def __init__(self, enabled=False, device='cpu'):
+        self.device_type = 'cuda' if str(device).startswith('cuda') \
+                           else 'cpu'
+        self.enabled = enabled and hasattr(torch, 'autocast')
+        if enabled and not self.enabled:
+            print('WARNING: torch {} has no autocast, training in '
+                  'float32'.format(torch.__version__))
+        if self.device_type == 'cuda':
+            self.dtype = torch.float16
+        else:
+            self.dtype = torch.bfloat16
+        self.scaler = None
+        if self.enabled and self.device_type == 'cuda':
+            if hasattr(torch, 'amp') and hasattr(torch.amp, 'GradScaler'):
+                self.scaler = torch.amp.GradScaler('cuda')
+            else:
+                self.scaler = torch.cuda.amp.GradScaler()
+
+    def autocast(self, enabled=True):
+        """ Context of the forward passes and losses; enabled=False
+            forces float32 inside an autocast region
+        """
+        if not self.enabled:
+            return contextlib.suppress()
+        return torch.autocast(self.device_type, dtype=self.dtype,
+                              enabled=enabled)
+
+    def backward(self, loss):
+        if self.scaler is None:
+            loss.backward()
+        else:
+            self.scaler.scale(loss).backward()
+
+    def step(self, optimizer):
+        # skipped by the scaler if the grads overflowed
+        if self.scaler is None:
+            optimizer.step()
+        else:
+            self.scaler.step(optimizer)
+
+    def update(self):
+        # once per iteration, after all the optimizers stepped
+        if self.scaler is not None:
+            self.scaler.update()
+
+
+@contextlib.contextmanager
+def frozen_stats(module):
+    """ Context where the BatchNorm running stats and the spectral norm
+        power iterations of module are not updated
+    """
+    saved = []
+    counts = []
+    for m in module.modules():
+        if isinstance(m, nn.modules.batchnorm._BatchNorm):
+            saved.append((m, 'momentum', m.momentum))
+            m.momentum = 0.
+            if getattr(m, 'num_batches_tracked', None) is not None:
+                counts.append((m.num_batches_tracked,
+                               m.num_batches_tracked.clone()))
+        for hook in m._forward_pre_hooks.values():
+            # (with no stored v, as in torch 0.4, v needs an iteration)
+            if isinstance(hook, SpectralNorm) and \
+               hasattr(m, hook.name + '_v'):
+                saved.append((hook, 'n_power_iterations',
+                              hook.n_power_iterations))
+                hook.n_power_iterations = 0
+    try:
+        yield
+    finally:
+        for obj, attr, value in saved:
+            setattr(obj, attr, value)
+        for count, value in counts:
+            count.copy_(value)
+
+# non-reentrant checkpoint, with a context for the recomputation
+CHECKPOINT_CONTEXT = 'context_fn' in \
+                     inspect.signature(checkpoint).parameters
+
+def checkpoint_forward(module, *args, **kwargs):
+    """ module(*args, **kwargs) without keeping its activations for
+        backward, where they are recomputed (with frozen_stats, so the
+        recomputation sees the weights of the forward)
+    """
+    fn = functools.partial(module, **kwargs)
+    if not torch.is_grad_enabled():
+        return fn(*args)
+    compiler = getattr(torch, 'compiler', None)
+    if compiler is not None and hasattr(compiler, 'is_compiling') and \
+       compiler.is_compiling():
+        # graphs cannot capture the frozen_stats recomputation: the
+        # checkpointed block runs eagerly, out of the graph
+        return compiler.disable(checkpoint_forward)(module, *args,
+                                                    **kwargs)
+    if CHECKPOINT_CONTEXT:
+        return checkpoint(fn, *args, use_reentrant=False,
+                          context_fn=lambda: (contextlib.suppress(),
+                                              frozen_stats(module)))
+    # reentrant checkpoint needs an input with grad, or the module
+    # params get none
+    if not any(torch.is_tensor(arg) and arg.requires_grad for arg in args):
+        return fn(*args)
+    def run(*args):
+        # first call is the forward, the next one its recomputation
+        run.calls += 1
+        if run.calls > 1:
+            with frozen_stats(module):
+                return fn(*args)
+        return fn(*args)
+    run.calls = 0
+    return checkpoint(run, *args)
+
+
 class Model(nn.Module):
 
     def __init__(self, name='BaseModel'):
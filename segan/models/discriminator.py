@@ -5,10 +5,10 @@ import torch.nn.utils as nnu
 import torch.nn.functional as F
 from collections import OrderedDict
 try:
-    from core import Model, LayerNorm
+    from core import Model, LayerNorm, checkpoint_forward
     from modules import *
 except ImportError:
-    from .core import Model, LayerNorm
+    from .core import Model, LayerNorm, checkpoint_forward
     from .modules import *
 
 # BEWARE: PyTorch >= 0.4.1 REQUIRED
@@ -71,8 +71,12 @@ class Discriminator(Model):
                  norm_type='bnorm',
                  bias=True,
                  phase_shift=None, 
-                 sinc_conv=False):
+                 sinc_conv=False,
+                 checkpoint_blocks=False):
         super().__init__(name='Discriminator')
+        # recompute the conv blocks in backward instead of keeping
+        # their activations
+        self.checkpoint_blocks = checkpoint_blocks
         # phase_shift randomly occurs within D layers
         # as proposed in https://arxiv.org/pdf/1802.04208.pdf
         # phase shift has to be specified as an integer
@@ -147,6 +151,11 @@ class Discriminator(Model):
         else:
             raise TypeError('Unrecognized pool type: ', pool_type)
     
+    def forward_block(self, block, h):
+        if self.checkpoint_blocks:
+            return checkpoint_forward(block, h)
+        return block(h)
+
     def forward(self, x):
         h = x
         if hasattr(self, 'sinc_conv'):
@@ -170,7 +179,7 @@ class Discriminator(Model):
                     sp1 = h[:, :, :shift]
                     sp2 = h[:, :, shift:]
                     h = torch.cat((sp2, sp1), dim=2)
-            h = layer(h)
+            h = self.forward_block(layer, h)
             int_act['h_{}'.format(ii)] = h
         if self.pool_type == 'conv':
             h = self.pool_conv(h)
@@ -193,6 +202,60 @@ class Discriminator(Model):
         int_act['logit'] = y
         return y, int_act
 
+    def sample_shifts(self):
+        """ Phase shifts of every layer, drawn as forward does: a
+            LongTensor of signed shifts (> 0 right), or None
+        """
+        if self.phase_shift is None:
+            return None
+        shifts = []
+        for _ in self.enc_blocks:
+            shift = random.randint(1, self.phase_shift)
+            right = random.random() > 0.5
+            shifts.append(shift if right else -shift)
+        return torch.LongTensor(shifts)
+
+    def forward_graph(self, x, shifts=None):
+        """ forward with the phase shifts given (see sample_shifts) as
+            a tensor, so the random shift of every step runs in the
+            same graph (e.g. of torch.compile), with no intermediate
+            activations kept
+
+            # Returns
+                logits
+        """
+        h = x
+        if hasattr(self, 'sinc_conv'):
+            h_l, h_r = torch.chunk(h, 2, dim=1)
+            h_l = self.sinc_conv(h_l)
+            h_r = self.sinc_conv(h_r)
+            h = torch.cat((h_l, h_r), dim=1)
+        for ii, layer in enumerate(self.enc_blocks):
+            if shifts is not None:
+                # circular shift in time: h[t] <- h[t - shift]
+                T = h.size(2)
+                idxs = torch.arange(T, device=h.device) - shifts[ii]
+                h = h.index_select(2, torch.remainder(idxs, T))
+            h = self.forward_block(layer, h)
+        if self.pool_type == 'conv':
+            h = self.pool_conv(h)
+            h = h.view(h.size(0), -1)
+            y = self.fc(h)
+        elif self.pool_type == 'none':
+            h = h.view(h.size(0), -1)
+            y = self.fc(h)
+        elif self.pool_type == 'gmax':
+            h = self.gmax(h)
+            h = h.view(h.size(0), -1)
+            y = self.fc(h)
+        elif self.pool_type == 'gavg':
+            h = self.gavg(h)
+            h = h.view(h.size(0), -1)
+            y = self.fc(h)
+        elif self.pool_type == 'mlp':
+            y = self.mlp(h)
+        return y
+
 
 if __name__ == '__main__':
     # pool_slen = 16 because we have input len 16384
@@ -94,7 +94,11 @@ class Generator(Model):
                  norm_type=None,
                  skip_merge='sum',
                  skip_kwidth=11,
+                 checkpoint_blocks=None,
                  name='Generator'):
+        # checkpoint_blocks: blocks recomputed in backward instead of
+        # keeping their activations: enc, dec, skip (all of a kind) or
+        # e.g. enc_0 (one of them)
         super().__init__(name=name)
         self.skip = skip
         self.bias = bias
@@ -176,13 +180,36 @@ class Generator(Model):
                 )
             self.dec_blocks.append(dec_block)
             ninp = fmap
+        num_blocks = {'enc':len(self.enc_blocks),
+                      'dec':len(self.dec_blocks),
+                      'skip':len(self.enc_blocks) - 1}
+        self.checkpoint_blocks = set()
+        for block in checkpoint_blocks or []:
+            part, _, idx = block.partition('_')
+            if part not in num_blocks:
+                raise ValueError('Unrecognized checkpoint block: ', block)
+            if idx == '':
+                idxs = range(num_blocks[part])
+            else:
+                if not idx.isdigit() or int(idx) >= num_blocks[part]:
+                    raise ValueError('Checkpoint block {} out of the {} {} '
+                                     'blocks'.format(block, num_blocks[part],
+                                                     part))
+                idxs = [int(idx)]
+            self.checkpoint_blocks.update((part, i) for i in idxs)
+
+    def forward_block(self, part, idx, block, *args, **kwargs):
+        if (part, idx) in self.checkpoint_blocks:
+            return checkpoint_forward(block, *args, **kwargs)
+        return block(*args, **kwargs)
 
     def forward(self, x, z=None, ret_hid=False):
         hall = {}
         hi = x
         skips = self.skips
         for l_i, enc_layer in enumerate(self.enc_blocks):
-            hi, linear_hi = enc_layer(hi, True)
+            hi, linear_hi = self.forward_block('enc', l_i, enc_layer, hi,
+                                               ret_linear=True)
             #print('ENC {} hi size: {}'.format(l_i, hi.size()))
                     #print('Adding skip[{}]={}, alpha={}'.format(l_i,
                     #                                            hi.size(),
@@ -216,10 +243,12 @@ class Generator(Model):
                 #print('Merging  hi {} with skip {} of hj {}'.format(hi.size(),
                 #                                                    l_i,
                 #                                                    skip_conn['tensor'].size()))
-                hi = skip_conn['alpha'](skip_conn['tensor'], hi)
+                hi = self.forward_block('skip', enc_layer_idx,
+                                        skip_conn['alpha'],
+                                        skip_conn['tensor'], hi)
             #print('DEC in size after skip and z_all: ', hi.size())
             #print('decoding layer {} with input {}'.format(l_i, hi.size()))
-            hi = dec_layer(hi)
+            hi = self.forward_block('dec', l_i, dec_layer, hi)
             #print('decoding layer {} output {}'.format(l_i, hi.size()))
             enc_layer_idx -= 1
             if ret_hid:
@@ -229,6 +258,42 @@ class Generator(Model):
         else:
             return hi
 
+    def z_size(self, x):
+        """ Size of the z of input x: B x z_dim x encoder output len """
+        T = x.size(2)
+        for enc_layer in self.enc_blocks:
+            T = enc_layer.out_size(T)
+        return (x.size(0), self.z_dim, T)
+
+    def forward_graph(self, x, z=None):
+        """ forward without Python side state: skips are local tensors,
+            z has to be given (unless no_z) and nothing is stored in
+            the module, so that it can be captured as one graph (e.g.
+            by torch.compile)
+
+            # Returns
+                (output, last encoder activation)
+        """
+        hi = x
+        skip_hs = []
+        for l_i, enc_layer in enumerate(self.enc_blocks):
+            hi, linear_hi = self.forward_block('enc', l_i, enc_layer, hi,
+                                               ret_linear=True)
+            skip_hs.append(linear_hi)
+        code = hi
+        if not self.no_z:
+            hi = torch.cat((z, hi), dim=1)
+        enc_layer_idx = len(self.enc_blocks) - 1
+        for l_i, dec_layer in enumerate(self.dec_blocks):
+            if self.skip and enc_layer_idx in self.skips and \
+            self.dec_poolings[l_i] > 1:
+                gskip = self.skips[enc_layer_idx]['alpha']
+                hi = self.forward_block('skip', enc_layer_idx, gskip,
+                                        skip_hs[enc_layer_idx], hi)
+            hi = self.forward_block('dec', l_i, dec_layer, hi)
+            enc_layer_idx -= 1
+        return hi, code
+
 class Generator1D(Model):
 
     def __init__(self, ninputs, enc_fmaps, kwidth,
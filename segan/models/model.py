@@ -20,6 +20,7 @@ from .discriminator import *
 from .core import *
 import json
 import os
+import contextlib
 from torch import autograd
 from scipy import signal
 
@@ -93,7 +94,10 @@ class SEGAN(Model):
                                skip_init=opts.skip_init,
                                skip_type=opts.skip_type,
                                skip_merge=opts.skip_merge,
-                               skip_kwidth=opts.skip_kwidth)
+                               skip_kwidth=opts.skip_kwidth,
+                               checkpoint_blocks=getattr(opts,
+                                                         'g_checkpoint',
+                                                         None))
         else:
             self.G = generator
         self.G.apply(weights_init)
@@ -107,11 +111,34 @@ class SEGAN(Model):
                                    pool_slen=opts.dpool_slen, 
                                    norm_type=opts.dnorm_type,
                                    phase_shift=opts.phase_shift,
-                                   sinc_conv=opts.sinc_conv)
+                                   sinc_conv=opts.sinc_conv,
+                                   checkpoint_blocks=getattr(opts,
+                                                             'd_checkpoint',
+                                                             False))
         else:
             self.D = discriminator
         self.D.apply(weights_init)
         print('Discriminator: ', self.D)
+        # graph forwards of G and D, set by compile_graphs
+        self.G_graph = None
+        self.D_graph = None
+
+    def compile_graphs(self):
+        """ Route infer_G and infer_D (in training and inference)
+            through the stateless forward_graph of G and D, compiled
+            with torch.compile when torch has it. z and the D phase
+            shifts are drawn outside of the compiled region.
+        """
+        self.G_graph = self.G.forward_graph
+        if self.D is not None:
+            self.D_graph = self.D.forward_graph
+        if hasattr(torch, 'compile'):
+            self.G_graph = torch.compile(self.G_graph)
+            if self.D is not None:
+                self.D_graph = torch.compile(self.D_graph)
+        else:
+            print('WARNING: torch {} has no compile, running the graph '
+                  'forwards eagerly'.format(torch.__version__))
 
     def generate(self, inwav, z = None, device='cpu'):
         self.G.eval()
@@ -135,12 +162,7 @@ class SEGAN(Model):
             if isinstance(x, np.ndarray):
                 x = torch.FloatTensor(x)
             x = x.to(device)
-            canvas_w, hall = self.infer_G(x, z=z, ret_hid=True)
-            nums = []
-            for k in hall.keys():
-                if 'enc' in k and 'zc' not in k:
-                    nums.append(int(k.split('_')[1]))
-            g_c = hall['enc_{}'.format(max(nums))]
+            canvas_w, g_c = self.infer_G_code(x, z=z)
             if z is None and hasattr(self.G, 'z'):
                 # if z was created inside G as first inference
                 z = self.G.z
@@ -163,6 +185,9 @@ class SEGAN(Model):
         return d_veredict
 
     def infer_G(self, nwav, cwav=None, z=None, ret_hid=False):
+        # the graph returns no hidden states: ret_hid runs the eager G
+        if self.G_graph is not None and not ret_hid:
+            return self.infer_G_code(nwav, z=z)[0]
         if ret_hid:
             Genh, hall = self.G(nwav, z=z, ret_hid=ret_hid)
             return Genh, hall
@@ -170,8 +195,62 @@ class SEGAN(Model):
             Genh = self.G(nwav, z=z, ret_hid=ret_hid)
             return Genh
 
+    def infer_G_code(self, nwav, z=None):
+        """ G output and last encoder activation (the code), from the
+            graph of G if compiled
+        """
+        if self.G_graph is not None:
+            if z is None:
+                z = self.sample_z(nwav)
+            elif not hasattr(self.G, 'z'):
+                self.G.z = z
+            return self.G_graph(nwav, z)
+        Genh, hall = self.G(nwav, z=z, ret_hid=True)
+        return Genh, hall['enc_{}'.format(len(self.G.enc_blocks) - 1)]
+
+    def sample_z(self, nwav):
+        """ z of G for input nwav, drawn as the G forward does, and kept
+            as G.z if it has none yet (None if G has no z)
+        """
+        if self.G.no_z:
+            return None
+        z = torch.randn(*self.G.z_size(nwav))
+        if nwav.is_cuda:
+            z = z.to('cuda')
+        if not hasattr(self.G, 'z'):
+            self.G.z = z
+        return z
+
+    def micro_batches(self, bsz, micro_batch=None):
+        """ Split a batch of bsz in micro-batches of up to micro_batch
+
+            # Returns
+                list of (slice, weight of its mean losses in the batch)
+        """
+        if micro_batch is None or micro_batch >= bsz:
+            return [(slice(0, bsz), 1.)]
+        return [(slice(beg, min(beg + micro_batch, bsz)),
+                 (min(beg + micro_batch, bsz) - beg) / bsz) \
+                for beg in range(0, bsz, micro_batch)]
+
+    def micro_batch_stats(self, frozen, *modules):
+        """ Context freezing (if frozen) the BatchNorm running stats and
+            spectral norm power iterations of modules, so that with
+            micro-batches they advance once per batch, as without them
+        """
+        modules = [m for m in modules if m is not None]
+        if not frozen or len(modules) == 0:
+            return contextlib.suppress()
+        return frozen_stats(nn.ModuleList(modules))
+
     def infer_D(self, x_, ref):
         D_in = torch.cat((x_, ref), dim=1)
+        if self.D_graph is not None:
+            shifts = self.D.sample_shifts()
+            if shifts is not None:
+                shifts = shifts.to(D_in.device)
+            d_out = self.D_graph(D_in, shifts)
+            return d_out, {'logit':d_out}
         return self.D(D_in)
 
     def gen_train_samples(self, clean_samples, noisy_samples, z_sample, 
@@ -181,11 +260,18 @@ class SEGAN(Model):
         else:
             canvas_w = self.infer_G(noisy_samples, clean_samples)
         sample_dif = noisy_samples - clean_samples
+        # de-emph the whole batches on device, then copy them once
+        canvas_w = torch_de_emphasize(canvas_w[:, 0].detach(),
+                                      self.preemph).cpu().numpy()
+        clean_w = torch_de_emphasize(clean_samples[:, 0].detach(),
+                                     self.preemph).cpu().numpy()
+        noisy_w = torch_de_emphasize(noisy_samples[:, 0].detach(),
+                                     self.preemph).cpu().numpy()
+        dif_w = torch_de_emphasize(sample_dif[:, 0].detach(),
+                                   self.preemph).cpu().numpy()
         # sample wavs
         for m in range(noisy_samples.size(0)):
-            m_canvas = de_emphasize(canvas_w[m,
-                                             0].cpu().data.numpy(),
-                                    self.preemph)
+            m_canvas = canvas_w[m]
             print('w{} max: {} min: {}'.format(m,
                                                m_canvas.max(),
                                                m_canvas.min()))
@@ -194,15 +280,9 @@ class SEGAN(Model):
                                        '{}.wav'.format(iteration,
                                                        m)),
                           int(16e3), m_canvas)
-            m_clean = de_emphasize(clean_samples[m,
-                                                 0].cpu().data.numpy(),
-                                   self.preemph)
-            m_noisy = de_emphasize(noisy_samples[m,
-                                                 0].cpu().data.numpy(),
-                                   self.preemph)
-            m_dif = de_emphasize(sample_dif[m,
-                                            0].cpu().data.numpy(),
-                                 self.preemph)
+            m_clean = clean_w[m]
+            m_noisy = noisy_w[m]
+            m_dif = dif_w[m]
             m_gtruth_path = os.path.join(self.save_path,
                                          'gtruth_{}.wav'.format(m))
             if not os.path.exists(m_gtruth_path):
@@ -250,7 +330,8 @@ class SEGAN(Model):
         num_batches = len(dloader) 
         l1_weight = l1_init
         iteration = 1
-        timings = []
+        # per iteration times, kept for bench_train.py
+        timings = self.timings = []
         evals = {}
         noisy_evals = {}
         noisy_samples = None
@@ -263,6 +344,8 @@ class SEGAN(Model):
         # make label tensor
         label = torch.ones(opts.batch_size)
         label = label.to(device)
+        # optional autocast (fp16/bf16) and loss scaling
+        amp = MixedPrecision(opts.amp, device)
 
         for epoch in range(1, opts.epoch + 1):
             beg_t = timeit.default_timer()
@@ -286,39 +369,93 @@ class SEGAN(Model):
                 clean = clean.to(device)
                 noisy = noisy.to(device)
                 if noisy_samples is None:
-                    noisy_samples = noisy[:20, :, :].contiguous()
-                    clean_samples = clean[:20, :, :].contiguous()
+                    # copies: batches may alias recycled (pooled) buffers
+                    noisy_samples = noisy[:20, :, :].clone()
+                    clean_samples = clean[:20, :, :].clone()
+                # grads accumulated over micro-batches, each loss
+                # weighted by its share of the batch mean
+                mbatches = self.micro_batches(clean.size(0),
+                                              opts.micro_batch)
+                # z of the whole batch, the same in the D and G updates
+                z = self.sample_z(noisy)
                 # (1) D real update
+                # one micro-batch loop per D forward of the batch, so the
+                # D norm state of each advances as without micro-batches
                 Dopt.zero_grad()
-                total_d_fake_loss = 0
-                total_d_real_loss = 0
-                Genh = self.infer_G(noisy, clean)
-                lab = label
-                d_real, _ = self.infer_D(clean, noisy)
-                d_real_loss = criterion(d_real.view(-1), lab)
-                d_real_loss.backward()
-                total_d_real_loss += d_real_loss
+                d_real_loss = 0
+                d_reals = []
+                for m_i, (mb, mb_w) in enumerate(mbatches):
+                    with amp.autocast(), \
+                         self.micro_batch_stats(m_i > 0, self.D):
+                        lab = label[mb].fill_(1)
+                        d_real, _ = self.infer_D(clean[mb], noisy[mb])
+                        mb_d_real_loss = mb_w * criterion(d_real.view(-1),
+                                                          lab)
+                    amp.backward(mb_d_real_loss)
+                    d_real_loss += mb_d_real_loss.detach()
+                    d_reals.append(d_real.detach())
                 
                 # (2) D fake update
-                d_fake, _ = self.infer_D(Genh.detach(), noisy)
-                lab = label.fill_(0)
-                d_fake_loss = criterion(d_fake.view(-1), lab)
-                d_fake_loss.backward()
-                total_d_fake_loss += d_fake_loss
-                Dopt.step()
+                d_fake_loss = 0
+                d_fakes = []
+                for m_i, (mb, mb_w) in enumerate(mbatches):
+                    z_mb = None if z is None else z[mb]
+                    mb_stats = self.micro_batch_stats(m_i > 0, self.G,
+                                                      self.D)
+                    with amp.autocast(), mb_stats:
+                        if len(mbatches) > 1:
+                            # recomputed with grads in the G update
+                            with torch.no_grad():
+                                Genh = self.infer_G(noisy[mb], clean[mb],
+                                                    z=z_mb)
+                        else:
+                            Genh = self.infer_G(noisy[mb], clean[mb],
+                                                z=z_mb)
+                        d_fake, _ = self.infer_D(Genh.detach(), noisy[mb])
+                        lab = label[mb].fill_(0)
+                        mb_d_fake_loss = mb_w * criterion(d_fake.view(-1),
+                                                          lab)
+                    amp.backward(mb_d_fake_loss)
+                    d_fake_loss += mb_d_fake_loss.detach()
+                    d_fakes.append(d_fake.detach())
+                amp.step(Dopt)
+                d_real = torch.cat(d_reals, dim=0)
+                d_fake = torch.cat(d_fakes, dim=0)
 
                 d_loss = d_fake_loss + d_real_loss 
 
                 # (3) G real update
                 Gopt.zero_grad()
-                lab = label.fill_(1)
-                d_fake_, _ = self.infer_D(Genh, noisy)
-                g_adv_loss = criterion(d_fake_.view(-1), lab)
-                #g_l1_loss = l1_weight * F.l1_loss(Genh, clean)
-                g_l1_loss = l1_weight * self.reg_loss(Genh, clean)
-                g_loss = g_adv_loss + g_l1_loss
-                g_loss.backward()
-                Gopt.step()
+                g_adv_loss = 0
+                g_l1_loss = 0
+                d_fakes_ = []
+                Genhs = []
+                for m_i, (mb, mb_w) in enumerate(mbatches):
+                    z_mb = None if z is None else z[mb]
+                    with amp.autocast():
+                        if len(mbatches) > 1:
+                            # G norm state already advanced in the D update
+                            with self.micro_batch_stats(True, self.G):
+                                Genh = self.infer_G(noisy[mb], clean[mb],
+                                                    z=z_mb)
+                        lab = label[mb].fill_(1)
+                        with self.micro_batch_stats(m_i > 0, self.D):
+                            d_fake_, _ = self.infer_D(Genh, noisy[mb])
+                        mb_g_adv_loss = mb_w * criterion(d_fake_.view(-1),
+                                                         lab)
+                        #g_l1_loss = l1_weight * F.l1_loss(Genh, clean)
+                        mb_g_l1_loss = mb_w * l1_weight * \
+                                       self.reg_loss(Genh, clean[mb])
+                        g_loss = mb_g_adv_loss + mb_g_l1_loss
+                    amp.backward(g_loss)
+                    g_adv_loss += mb_g_adv_loss.detach()
+                    g_l1_loss += mb_g_l1_loss.detach()
+                    d_fakes_.append(d_fake_.detach())
+                    Genhs.append(Genh.detach())
+                amp.step(Gopt)
+                amp.update()
+                d_fake_ = torch.cat(d_fakes_, dim=0)
+                Genh = torch.cat(Genhs, dim=0)
                 end_t = timeit.default_timer()
                 timings.append(end_t - beg_t)
                 beg_t = timeit.default_timer()
@@ -355,13 +492,17 @@ class SEGAN(Model):
                                            iteration)
                     self.writer.add_scalar('G_l1', g_l1_loss_v,
                                            iteration)
-                    self.writer.add_histogram('D_fake__hist', d_fake_.cpu().data,
+                    # float copies, numpy has no bfloat16 (amp on cpu)
+                    self.writer.add_histogram('D_fake__hist',
+                                              d_fake_.float().cpu().data,
                                               iteration, bins='sturges')
-                    self.writer.add_histogram('D_fake_hist', d_fake.cpu().data,
+                    self.writer.add_histogram('D_fake_hist',
+                                              d_fake.float().cpu().data,
                                               iteration, bins='sturges')
-                    self.writer.add_histogram('D_real_hist', d_real.cpu().data,
+                    self.writer.add_histogram('D_real_hist',
+                                              d_real.float().cpu().data,
                                               iteration, bins='sturges')
-                    self.writer.add_histogram('Gz', Genh.cpu().data,
+                    self.writer.add_histogram('Gz', Genh.float().cpu().data,
                                               iteration, bins='sturges')
                     self.writer.add_histogram('clean', clean.cpu().data,
                                               iteration, bins='sturges')
@@ -471,15 +612,13 @@ class SEGAN(Model):
                 Genh = self.infer_G(noisy).squeeze(1)
                 clean_npy = clean.cpu().data.numpy()
                 Genh_npy = Genh.cpu().data.numpy()
-                clean_npy = np.apply_along_axis(de_emphasize, 0, clean_npy,
-                                                self.preemph)
-                Genh_npy = np.apply_along_axis(de_emphasize, 0, Genh_npy,
-                                                self.preemph)
+                # de-emph every wav of the batch over time
+                clean_npy = de_emphasize(clean_npy, self.preemph)
+                Genh_npy = de_emphasize(Genh_npy, self.preemph)
                 beg_t = timeit.default_timer()
                 if do_noisy:
                     noisy_npy = noisy.cpu().data.numpy()
-                    noisy_npy = np.apply_along_axis(de_emphasize, 0, noisy_npy,
-                                                    self.preemph)
+                    noisy_npy = de_emphasize(noisy_npy, self.preemph)
                     args = [(clean_npy[i], Genh_npy[i], noisy_npy[i]) for i in \
                             range(clean.size(0))]
                 else:
@@ -524,7 +663,18 @@ class WSEGAN(SEGAN):
         self.D.apply(wsegan_weights_init)
 
     def sample_dloader(self, dloader, device='cpu'):
-        sample = next(dloader.__iter__())
+        # one iterator along training: building one per step re-forks
+        # the workers and drops all their prefetched batches but one
+        if getattr(self, 'dloader_iter', None) is None or \
+           self.dloader_src is not dloader:
+            self.dloader_src = dloader
+            self.dloader_iter = iter(dloader)
+        try:
+            sample = next(self.dloader_iter)
+        except StopIteration:
+            # end of epoch of a finite sampler, re-shuffled by a new iter
+            self.dloader_iter = iter(dloader)
+            sample = next(self.dloader_iter)
         batch = sample
         uttname, clean, noisy, slice_idx = batch
         clean = clean.unsqueeze(1)
@@ -534,10 +684,6 @@ class WSEGAN(SEGAN):
         slice_idx = slice_idx.to(device)
         return uttname, clean, noisy, slice_idx
 
-    def infer_G(self, nwav, cwav=None, z=None, ret_hid=False):
-        Genh = self.G(nwav, z=z, ret_hid=ret_hid)
-        return Genh
-
     def train(self, opts, dloader, criterion, l1_init, l1_dec_step,
               l1_dec_epoch, log_freq, va_dloader=None, device='cpu'):
 
@@ -560,7 +706,8 @@ class WSEGAN(SEGAN):
         num_batches = len(dloader) 
         l1_weight = l1_init
         iteration = 1
-        timings = []
+        # per iteration times, kept for bench_train.py
+        timings = self.timings = []
         evals = {}
         noisy_evals = {}
         noisy_samples = None
@@ -568,48 +715,85 @@ class WSEGAN(SEGAN):
         z_sample = None
         patience = opts.patience
         best_val_obj = np.inf
+        # optional autocast (fp16/bf16) and loss scaling
+        amp = MixedPrecision(opts.amp, device)
 
         for iteration in range(1, opts.epoch * len(dloader) + 1):
             beg_t = timeit.default_timer()
             uttname, clean, noisy, slice_idx = self.sample_dloader(dloader,
                                                                    device)
             bsz = clean.size(0)
-            # grads
-            Dopt.zero_grad()
-            D_in = torch.cat((clean, noisy), dim=1)
-            d_real, _ = self.infer_D(clean, noisy)
-            rl_lab = torch.ones(d_real.size()).cuda()
             if self.vanilla_gan:
                 cost = F.binary_cross_entropy_with_logits
             else:
                 cost = F.mse_loss
-            d_real_loss = cost(d_real, rl_lab)
-            Genh = self.infer_G(noisy, clean)
-            fake = Genh.detach()
-            d_fake, _ = self.infer_D(fake, noisy)
-            fk_lab = torch.zeros(d_fake.size()).cuda()
-            
-            d_fake_loss = cost(d_fake, fk_lab)
-
+            # grads accumulated over micro-batches, each loss weighted
+            # by its share of the batch mean
+            mbatches = self.micro_batches(bsz, opts.micro_batch)
+            # z of the whole batch, the same in the D and G updates
+            z = self.sample_z(noisy)
+            # one micro-batch loop per D forward of the batch (a term of
+            # the D loss), so the D norm state of each advances as without
+            # micro-batches
             d_weight = 0.5 # count only d_fake and d_real
-            d_loss = d_fake_loss + d_real_loss
-
             if self.misalign_pair:
-                clean_shuf = list(torch.chunk(clean, clean.size(0), dim=0))
-                shuffle(clean_shuf)
-                clean_shuf = torch.cat(clean_shuf, dim=0)
-                d_fake_shuf, _ = self.infer_D(clean, clean_shuf)
-                d_fake_shuf_loss = cost(d_fake_shuf, fk_lab)
                 d_weight = 1 / 3 # count 3 components now
-                d_loss += d_fake_shuf_loss
+            if self.interf_pair:
+                d_weight = 1 / 4 # count 4 components in d loss now
+            # grads
+            Dopt.zero_grad()
+            d_loss = 0
+            for m_i, (mb, mb_w) in enumerate(mbatches):
+                with amp.autocast(), self.micro_batch_stats(m_i > 0, self.D):
+                    d_real, _ = self.infer_D(clean[mb], noisy[mb])
+                    rl_lab = torch.ones(d_real.size()).to(device)
+                    d_real_loss = cost(d_real, rl_lab)
+                    mb_d_loss = mb_w * d_weight * d_real_loss
+                amp.backward(mb_d_loss)
+                d_loss += mb_d_loss.detach()
+
+            for m_i, (mb, mb_w) in enumerate(mbatches):
+                z_mb = None if z is None else z[mb]
+                mb_stats = self.micro_batch_stats(m_i > 0, self.G, self.D)
+                with amp.autocast(), mb_stats:
+                    if len(mbatches) > 1:
+                        # recomputed with grads in the G update
+                        with torch.no_grad():
+                            Genh = self.infer_G(noisy[mb], clean[mb],
+                                                z=z_mb)
+                    else:
+                        Genh = self.infer_G(noisy[mb], clean[mb], z=z_mb)
+                    fake = Genh.detach()
+                    d_fake, _ = self.infer_D(fake, noisy[mb])
+                    fk_lab = torch.zeros(d_fake.size()).to(device)
+                    d_fake_loss = cost(d_fake, fk_lab)
+                    mb_d_loss = mb_w * d_weight * d_fake_loss
+                amp.backward(mb_d_loss)
+                d_loss += mb_d_loss.detach()
+
+            if self.misalign_pair:
+                perm = list(range(bsz))
+                shuffle(perm)
+                clean_shuf = clean[perm]
+                for m_i, (mb, mb_w) in enumerate(mbatches):
+                    with amp.autocast(), \
+                         self.micro_batch_stats(m_i > 0, self.D):
+                        d_fake_shuf, _ = self.infer_D(clean[mb],
+                                                      clean_shuf[mb])
+                        fk_lab = torch.zeros(d_fake_shuf.size()).to(device)
+                        d_fake_shuf_loss = cost(d_fake_shuf, fk_lab)
+                        mb_d_loss = mb_w * d_weight * d_fake_shuf_loss
+                    amp.backward(mb_d_loss)
+                    d_loss += mb_d_loss.detach()
 
             if self.interf_pair:
-                # put interferring squared signals with random amplitude and
-                # freq as fake signals mixed with clean data
-                # TODO: Beware with hard-coded values! possibly improve this
+                # put interferring squared signals with random
+                # amplitude and freq as fake signals mixed with
+                # clean data
+                # TODO: Beware with hard-coded values! possibly
+                # improve this
                 freqs = [250, 1000, 4000]
                 amps = [0.01, 0.05, 0.1, 1]
-                bsz = clean.size(0)
                 squares = []
                 t = np.linspace(0, 2, 32000)
                 for _ in range(bsz):
@@ -622,57 +806,95 @@ class WSEGAN(SEGAN):
                 if clean.is_cuda:
                     squares = squares.to('cuda')
                 interf = clean + squares
-                d_fake_inter, _ = self.infer_D(interf, noisy)
-                d_fake_inter_loss = cost(d_fake_inter, fk_lab)
-                d_weight = 1 / 4 # count 4 components in d loss now
-                d_loss += d_fake_inter_loss
-
-            d_loss = d_weight * d_loss
-            d_loss.backward()
-            Dopt.step()
+                for m_i, (mb, mb_w) in enumerate(mbatches):
+                    with amp.autocast(), \
+                         self.micro_batch_stats(m_i > 0, self.D):
+                        d_fake_inter, _ = self.infer_D(interf[mb],
+                                                       noisy[mb])
+                        fk_lab = torch.zeros(d_fake_inter.size()).to(device)
+                        d_fake_inter_loss = cost(d_fake_inter, fk_lab)
+                        mb_d_loss = mb_w * d_weight * d_fake_inter_loss
+                    amp.backward(mb_d_loss)
+                    d_loss += mb_d_loss.detach()
+            amp.step(Dopt)
 
             Gopt.zero_grad()
-            d_fake_, _ = self.infer_D(Genh, noisy)
-            g_adv_loss = cost(d_fake_, torch.ones(d_fake_.size()).cuda())
-
-            # POWER Loss -----------------------------------
-            # make stft of gtruth
-            clean_stft = torch.stft(clean.squeeze(1), 
-                                    n_fft=min(clean.size(-1), self.n_fft), 
-                                    hop_length=160,
-                                    win_length=320,
-                                    normalized=True)
-            clean_mod = torch.norm(clean_stft, 2, dim=3)
-            clean_mod_pow = 10 * torch.log10(clean_mod ** 2 + 10e-20)
-            Genh_stft = torch.stft(Genh.squeeze(1), 
-                                   n_fft=min(Genh.size(-1), self.n_fft),
-                                   hop_length=160, 
-                                   win_length=320, normalized=True)
-            Genh_mod = torch.norm(Genh_stft, 2, dim=3)
-            Genh_mod_pow = 10 * torch.log10(Genh_mod ** 2 + 10e-20)
-            pow_loss = self.pow_weight * F.l1_loss(Genh_mod_pow, clean_mod_pow)
-            G_cost = g_adv_loss + pow_loss
-            if l1_weight > 0:
-                # look for additive files to build batch mask
-                mask = torch.zeros(bsz, 1, Genh.size(2))
-                if opts.cuda:
-                    mask = mask.to('cuda')
-                for utt_i, uttn in enumerate(uttname):
-                    if 'additive' in uttn:
-                        mask[utt_i, 0, :] = 1.
-                den_loss = l1_weight * F.l1_loss(Genh * mask,
-                                                 clean * mask)
-                G_cost += den_loss
-            else:
+            G_cost = 0
+            g_adv_loss = 0
+            pow_loss = 0
+            den_loss = 0
+            Genhs = []
+            clean_mod_pows = []
+            Genh_mod_pows = []
+            for m_i, (mb, mb_w) in enumerate(mbatches):
+                z_mb = None if z is None else z[mb]
+                with amp.autocast():
+                    if len(mbatches) > 1:
+                        # G norm state already advanced in the D update
+                        with self.micro_batch_stats(True, self.G):
+                            Genh = self.infer_G(noisy[mb], clean[mb],
+                                                z=z_mb)
+                    with self.micro_batch_stats(m_i > 0, self.D):
+                        d_fake_, _ = self.infer_D(Genh, noisy[mb])
+                    mb_g_adv_loss = cost(d_fake_,
+                                         torch.ones(d_fake_.size()).to(device))
+
+                # POWER Loss -----------------------------------
+                # in float32: stft has no half kernels and the 10e-20
+                # floor underflows in fp16
+                # make stft of gtruth
+                clean_stft = torch.stft(clean[mb].squeeze(1), 
+                                        n_fft=min(clean.size(-1),
+                                                  self.n_fft), 
+                                        hop_length=160,
+                                        win_length=320,
+                                        normalized=True)
+                clean_mod = torch.norm(clean_stft, 2, dim=3)
+                clean_mod_pow = 10 * torch.log10(clean_mod ** 2 + 10e-20)
+                Genh_stft = torch.stft(Genh.float().squeeze(1), 
+                                       n_fft=min(Genh.size(-1), self.n_fft),
+                                       hop_length=160, 
+                                       win_length=320, normalized=True)
+                Genh_mod = torch.norm(Genh_stft, 2, dim=3)
+                Genh_mod_pow = 10 * torch.log10(Genh_mod ** 2 + 10e-20)
+                mb_pow_loss = self.pow_weight * F.l1_loss(Genh_mod_pow,
+                                                          clean_mod_pow)
+                mb_G_cost = mb_g_adv_loss.float() + mb_pow_loss
+                if l1_weight > 0:
+                    # look for additive files to build batch mask
+                    mask = torch.zeros(Genh.size(0), 1, Genh.size(2))
+                    if opts.cuda:
+                        mask = mask.to('cuda')
+                    for utt_i, uttn in enumerate(uttname[mb]):
+                        if 'additive' in uttn:
+                            mask[utt_i, 0, :] = 1.
+                    mb_den_loss = l1_weight * \
+                                  F.l1_loss(Genh.float() * mask,
+                                            clean[mb] * mask)
+                    mb_G_cost += mb_den_loss
+                    den_loss += mb_w * mb_den_loss.detach()
+                mb_G_cost = mb_w * mb_G_cost
+                amp.backward(mb_G_cost)
+                G_cost += mb_G_cost.detach()
+                g_adv_loss += mb_w * mb_g_adv_loss.detach()
+                pow_loss += mb_w * mb_pow_loss.detach()
+                Genhs.append(Genh.detach())
+                clean_mod_pows.append(clean_mod_pow.detach())
+                Genh_mod_pows.append(Genh_mod_pow.detach())
+            if l1_weight <= 0:
                 den_loss = torch.zeros(1)
-            G_cost.backward()
-            Gopt.step()
+            amp.step(Gopt)
+            amp.update()
+            Genh = torch.cat(Genhs, dim=0)
+            clean_mod_pow = torch.cat(clean_mod_pows, dim=0)
+            Genh_mod_pow = torch.cat(Genh_mod_pows, dim=0)
             end_t = timeit.default_timer()
             timings.append(end_t - beg_t)
             beg_t = timeit.default_timer()
             if noisy_samples is None:
-                noisy_samples = noisy[:20, :, :].contiguous()
-                clean_samples = clean[:20, :, :].contiguous()
+                # copies: batches may alias recycled (pooled) buffers
+                noisy_samples = noisy[:20, :, :].clone()
+                clean_samples = clean[:20, :, :].clone()
             if z_sample is None and not self.G.no_z:
                 # capture sample now that we know shape after first
                 # inference
@@ -711,7 +933,7 @@ class WSEGAN(SEGAN):
                                           Genh_mod_pow.cpu().data,
                                           iteration,
                                           bins='sturges')
-                self.writer.add_histogram('Gz', Genh.cpu().data,
+                self.writer.add_histogram('Gz', Genh.float().cpu().data,
                                           iteration, bins='sturges')
                 self.writer.add_histogram('clean', clean.cpu().data,
                                           iteration, bins='sturges')
@@ -760,10 +982,10 @@ class WSEGAN(SEGAN):
         self.G.eval()
         ori_len = inwav.size(2)
         p_wav = make_divN(inwav.transpose(1, 2), 1024).transpose(1, 2)
-        c_res, hall = self.infer_G(p_wav, z=z, ret_hid=True)
+        c_res, g_c = self.infer_G_code(p_wav, z=z)
         c_res = c_res[0, 0, :ori_len].cpu().data.numpy()
         c_res = de_emphasize(c_res, self.preemph)
-        return c_res, hall
+        return c_res, g_c
 
 
 class AEWSEGAN(WSEGAN):
@@ -801,7 +1023,8 @@ class AEWSEGAN(WSEGAN):
         num_batches = len(dloader) 
         l2_weight = l1_init
         iteration = 1
-        timings = []
+        # per iteration times, kept for bench_train.py
+        timings = self.timings = []
         evals = {}
         noisy_evals = {}
         noisy_samples = None
@@ -812,26 +1035,44 @@ class AEWSEGAN(WSEGAN):
         # acumulator for exponential avg of valid curve
         acum_val_obj = 0
         G = self.G
+        # optional autocast (fp16/bf16) and loss scaling
+        amp = MixedPrecision(opts.amp, device)
 
         for iteration in range(1, opts.epoch * len(dloader) + 1):
             beg_t = timeit.default_timer()
             uttname, clean, noisy, slice_idx = self.sample_dloader(dloader,
                                                                    device)
             bsz = clean.size(0)
-            Genh = self.infer_G(noisy, clean)
+            # grads accumulated over micro-batches, each loss weighted
+            # by its share of the batch mean
+            z = self.sample_z(noisy)
             Gopt.zero_grad()
-            if self.l1_loss:
-                loss = F.l1_loss(Genh, clean)
-            else:
-                loss = F.mse_loss(Genh, clean)
-            loss.backward()
-            Gopt.step()
+            loss = 0
+            Genhs = []
+            mbatches = self.micro_batches(bsz, opts.micro_batch)
+            for m_i, (mb, mb_w) in enumerate(mbatches):
+                # G norm state advances with the first one
+                with amp.autocast(), self.micro_batch_stats(m_i > 0, G):
+                    Genh = self.infer_G(noisy[mb], clean[mb],
+                                        z=None if z is None else z[mb])
+                    if self.l1_loss:
+                        mb_loss = F.l1_loss(Genh, clean[mb])
+                    else:
+                        mb_loss = F.mse_loss(Genh, clean[mb])
+                    mb_loss = mb_w * mb_loss
+                amp.backward(mb_loss)
+                loss += mb_loss.detach()
+                Genhs.append(Genh.detach())
+            amp.step(Gopt)
+            amp.update()
+            Genh = torch.cat(Genhs, dim=0)
             end_t = timeit.default_timer()
             timings.append(end_t - beg_t)
             beg_t = timeit.default_timer()
             if noisy_samples is None:
-                noisy_samples = noisy[:20, :, :].contiguous()
-                clean_samples = clean[:20, :, :].contiguous()
+                # copies: batches may alias recycled (pooled) buffers
+                noisy_samples = noisy[:20, :, :].clone()
+                clean_samples = clean[:20, :, :].clone()
             if z_sample is None and not G.no_z:
                 # capture sample now that we know shape after first
                 # inference
@@ -848,7 +1089,7 @@ class AEWSEGAN(WSEGAN):
                                         normalized=True)
                 clean_mod = torch.norm(clean_stft, 2, dim=3)
                 clean_mod_pow = 10 * torch.log10(clean_mod ** 2 + 10e-20)
-                Genh_stft = torch.stft(Genh.detach().squeeze(1), 
+                Genh_stft = torch.stft(Genh.detach().float().squeeze(1), 
                                        n_fft=min(Genh.size(-1), self.n_fft),
                                        hop_length=160, 
                                        win_length=320, normalized=True)
@@ -879,7 +1120,7 @@ class AEWSEGAN(WSEGAN):
                                           Genh_mod_pow.cpu().data,
                                           iteration,
                                           bins='sturges')
-                self.writer.add_histogram('Gz', Genh.cpu().data,
+                self.writer.add_histogram('Gz', Genh.float().cpu().data,
                                           iteration, bins='sturges')
                 self.writer.add_histogram('clean', clean.cpu().data,
                                           iteration, bins='sturges')
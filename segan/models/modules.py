@@ -88,13 +88,20 @@ class GConv1DBlock(nn.Module):
         else:
             return x
 
-    def forward(self, x, ret_linear=False):
+    def padding(self):
         if self.stride > 1:
-            P = (self.kwidth // 2 - 1,
-                 self.kwidth // 2)
+            return (self.kwidth // 2 - 1,
+                    self.kwidth // 2)
         else:
-            P = (self.kwidth // 2,
-                 self.kwidth // 2)
+            return (self.kwidth // 2,
+                    self.kwidth // 2)
+
+    def out_size(self, T):
+        """ Output length of an input of length T """
+        return (T + sum(self.padding()) - self.kwidth) // self.stride + 1
+
+    def forward(self, x, ret_linear=False):
+        P = self.padding()
         x_p = F.pad(x, P, mode='reflect')
         a = self.conv(x_p)
         a = self.forward_norm(a, self.norm)
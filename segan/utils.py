@@ -12,8 +12,14 @@ import glob
 import librosa
 import numpy as np
 import tempfile
+import hashlib
 import os
 import re
+import json
+from collections import OrderedDict
+from functools import lru_cache
+from .datasets.packed import pack_signals, packed_exists, PackedSignals
+from .datasets.manifest import Manifest
 
 
 def uttname2spkid(uttname):
@@ -48,12 +54,61 @@ class ComposeAdditive(object):
     def __call__(self, x):
         return x, self.additive(x)
 
+# cumulative divisors of the anti-clipping rescaling, (1.1), (1.1 * 1.2)...
+PEAK_DIVS = np.concatenate(([1.], np.cumprod(1. + 0.1 * np.arange(1, 41))))
+
+def peak_normalize(noisy):
+    """ Rescale each row of a [B, T] tensor into [-1, 1), in closed form
+        of dividing by 1.1, 1.2, 1.3... until it fits
+    """
+    divs = torch.from_numpy(PEAK_DIVS).to(noisy.device)
+    maxs = noisy.max(dim=-1)[0].double().unsqueeze(-1)
+    mins = noisy.min(dim=-1)[0].double().unsqueeze(-1)
+    fits = (maxs < divs) & (mins >= -divs)
+    # first number of steps that fits
+    steps = fits.float().argmax(dim=-1)
+    return noisy / divs[steps].to(noisy.dtype).unsqueeze(-1)
+
+# IRS handset filter response [Hz, dB], relative to its gain at 1 kHz
+IRS_FILTER_DB = np.array([[0, -200], [50, -40], [100, -20],
+                          [125, -12], [160, -6], [200, 0],
+                          [250, 4], [300, 6], [350, 8], [400, 10],
+                          [500, 11], [600, 12], [700, 12], [800, 12],
+                          [1000, 12], [1300, 12], [1600, 12], [2000, 12],
+                          [2500, 12], [3000, 12], [3250, 12], [3500, 4],
+                          [4000, -200], [5000, -200], [6300, -200], 
+                          [8000, -200]]) 
+
+@lru_cache(maxsize=32)
+def irs_response(n_fft, srate):
+    """ IRS gain of the n_fft // 2 + 1 bins of a real FFT, computed
+        once per FFT size and rate
+    """
+    overall_gain = np.interp(1000, IRS_FILTER_DB[:, 0], IRS_FILTER_DB[:, 1])
+    freqs = np.arange(n_fft // 2 + 1) * (srate / n_fft)
+    factor_dB = np.interp(freqs, IRS_FILTER_DB[:, 0],
+                          IRS_FILTER_DB[:, 1]) - overall_gain
+    return 10 ** (factor_dB / 20)
+
+def load_noise(path):
+    return librosa.load(path, sr=None)[0].astype(np.float32)
+
 class Additive(object):
 
-    def __init__(self, noises_dir, snr_levels=[0, 5, 10], do_IRS=False):
+    def __init__(self, noises_dir, snr_levels=[0, 5, 10], do_IRS=False,
+                 asl_cache_size=10000, bank_path=None, workers=1):
         self.noises_dir = noises_dir
         self.snr_levels = snr_levels
         self.do_IRS = do_IRS
+        # LRU of P.56 levels of the last clean utterances
+        self.asl_cache_size = asl_cache_size
+        self.asl_cache = OrderedDict()
+        self.eps = 1e-22
+        self.bank = None
+        if bank_path is not None:
+            # noises packed in one float32 memory-mapped array
+            self.load_bank(bank_path, workers)
+            return
         # read noises in dir
         noises = glob.glob(os.path.join(noises_dir, '*.wav'))
         if len(noises) == 0:
@@ -70,37 +125,125 @@ class Additive(object):
                                  '{}'.format(n_i, len(noises),
                                              npath)
                 print(log_noise_load)
-        self.eps = 1e-22
 
-    def __call__(self, wav, srate=16000, nbits=16):
-        """ Add noise to clean wav """
+    def load_bank(self, bank_path, workers=1):
+        """ Load the noise bank {bank_path}.npy, packing the noises of
+            noises_dir into it first if they changed
+        """
+        manifest = Manifest(self.noises_dir, workers=workers)
+        if len(manifest) == 0:
+            raise ValueError('[!] No noises found in '
+                             '{}'.format(self.noises_dir))
+        paths = manifest.paths()[0]
+        fingerprint = manifest.fingerprint()
+        cfg = {}
+        if os.path.exists(bank_path + '.json'):
+            with open(bank_path + '.json', 'r') as cfg_f:
+                cfg = json.load(cfg_f)
+        if cfg.get('fingerprint') != fingerprint or \
+           not packed_exists(bank_path):
+            pack_signals(bank_path, paths, load_noise,
+                         manifest.lengths()[0], dtype=np.float32,
+                         workers=workers, verbose=True)
+            with open(bank_path + '.json', 'w') as cfg_f:
+                cfg_f.write(json.dumps({'fingerprint':fingerprint,
+                                        'files':paths}, indent=2))
+        self.bank = PackedSignals(bank_path)
+        self.noise_files = paths
+        print('[*] Loaded bank of {} noise files'.format(len(self.bank)))
+
+    def num_noises(self):
+        if self.bank is not None:
+            return len(self.bank)
+        return len(self.noises)
+
+    def noise_data(self, noise_idx):
+        if self.bank is not None:
+            return self.bank[noise_idx]
+        return self.noises[noise_idx]['data']
+
+    def __call__(self, wav, srate=16000, nbits=16, key=None):
+        """ Add noise to clean wav, with key naming the utterance to
+            cache its speech level
+        """
         if isinstance(wav, torch.Tensor):
             wav = wav.numpy()
-        noise_idx = np.random.choice(list(range(len(self.noises))), 1)
-        sel_noise = self.noises[np.asscalar(noise_idx)]
-        noise = sel_noise['data']
+        noise_idx = np.random.choice(list(range(self.num_noises())), 1)
+        noise = self.noise_data(int(noise_idx[0]))
         snr = np.random.choice(self.snr_levels, 1)
         # print('Applying SNR: {} dB'.format(snr[0]))
         if wav.ndim > 1:
             wav = wav.reshape((-1,))
         noisy, noise_bound = self.addnoise_asl(wav, noise, srate, 
                                                nbits, snr, 
-                                               do_IRS=self.do_IRS)
+                                               do_IRS=self.do_IRS,
+                                               key=key)
         # normalize to avoid clipping
-        if np.max(noisy) >= 1 or np.min(noisy) < -1:
-            small = 0.1
-            while np.max(noisy) >= 1 or np.min(noisy) < -1:
-                noisy = noisy / (1. + small)
-                small = small + 0.1
-        return torch.FloatTensor(noisy.astype(np.float32))
-
-
-    def addnoise_asl(self, clean, noise, srate, nbits, snr, do_IRS=False):
+        noisy = torch.from_numpy(noisy.astype(np.float32, copy=False))
+        return peak_normalize(noisy.unsqueeze(0))[0]
+
+    def mix_batch(self, clean, snrs=None, noise_idxs=None, offsets=None,
+                  levels=None, keys=None, srate=16000, nbits=16):
+        """ Add noise to a clean batch in one torch pass, on its device
+
+            # Arguments
+                clean: [B, T] tensor
+                snrs: [B] SNRs in dB (Def: drawn from snr_levels)
+                noise_idxs: [B] noise of each sample (Def: random)
+                offsets: [B] begin sample in each noise (Def: random)
+                levels: [B] P.56 active speech levels of clean, after
+                        the IRS filter if do_IRS (Def: computed, cached
+                        by keys)
+                keys: [B] utterance names, to cache their levels
+
+            # Returns
+                (noisy [B, T], noise_idxs, offsets)
+        """
+        B, T = clean.size()
+        if self.do_IRS:
+            clean = torch.from_numpy(self.apply_IRS(clean.detach().cpu().numpy(),
+                                                    srate, nbits)).to(clean.device)
+        if noise_idxs is None:
+            noise_idxs = np.random.randint(0, self.num_noises(), size=B)
+        if snrs is None:
+            snrs = np.random.choice(self.snr_levels, B)
+        if offsets is None:
+            offsets = []
+            for noise_idx in noise_idxs:
+                noise_len = self.noise_data(noise_idx).shape[0]
+                if noise_len <= T:
+                    raise ValueError('Noise length has to be greater than '
+                                     'speech length!')
+                offsets.append(np.random.randint(0, noise_len - T + 1))
+        if levels is None:
+            clean_npy = clean.detach().cpu().numpy()
+            levels = [self.asl_P56(clean_npy[b], srate, nbits,
+                                   key=None if keys is None else keys[b])[0]
+                      for b in range(B)]
+        # gathered from the bank: the only per-sample step
+        noise = np.stack([self.noise_data(noise_idx)[offset:offset + T] \
+                          for noise_idx, offset in zip(noise_idxs, offsets)])
+        if self.do_IRS:
+            # both batches through the handset filter at once
+            noise = self.apply_IRS(noise, srate, nbits)
+        noise = torch.from_numpy(noise).to(clean.device)
+        Px = torch.tensor(np.asarray(levels, dtype=np.float32),
+                          device=clean.device)
+        snrs = torch.tensor(np.asarray(snrs, dtype=np.float32),
+                            device=clean.device)
+        Pn = (noise ** 2).mean(dim=-1)
+        # noise scale for SNR = 10 * log10(Px / ((sf ** 2) * Pn))
+        sf = torch.sqrt(Px / Pn / (10 ** (snrs / 10)))
+        noisy = clean + sf.unsqueeze(-1) * noise
+        return peak_normalize(noisy), noise_idxs, offsets
+
+    def addnoise_asl(self, clean, noise, srate, nbits, snr, do_IRS=False,
+                     key=None):
         if do_IRS:
             # Apply IRS filter simulating telephone 
             # handset BW [300, 3200] Hz
             clean = self.apply_IRS(clean, srate, nbits)
-        Px, asl, c0 = self.asl_P56(clean, srate, nbits)
+        Px, asl, c0 = self.asl_P56(clean, srate, nbits, key=key)
         # Px is active speech level ms energy
         # asl is active factor
         # c0 is active speech level threshold
@@ -114,7 +257,7 @@ class Additive(object):
             raise ValueError('Noise length has to be greater than speech '
                              'length!')
         rand_start_limit = int(noise_len - x_len + 1)
-        rand_start = int(np.round((rand_start_limit - 1) * np.random.rand(1) \
+        rand_start = int(np.round((rand_start_limit - 1) * np.random.rand() \
                                   + 1))
         noise_segment = noise[rand_start:rand_start + x_len]
         noise_bounds = (rand_start, rand_start + x_len)
@@ -127,57 +270,54 @@ class Additive(object):
         # we need to scale the noise segment samples to obtain the 
         # desired SNR = 10 * log10( Px / ((sf ** 2) * Pn))
         sf = np.sqrt(Px / Pn / (10 ** (snr / 10)))
-        noise_segment = noise_segment * sf
+        # scale in the dtype of the noise, not widened by float64 sf
+        noise_segment = noise_segment * sf.astype(noise_segment.dtype)
     
         noisy = x + noise_segment
 
         return noisy, noise_bounds
 
     def apply_IRS(self, data, srate, nbits):
-        """ Apply telephone handset BW [300, 3200] Hz """
-        raise NotImplementedError('Under construction!')
-        from pyfftw.interfaces import scipy_fftpack as fftw
-        n = data.shape[0]
+        """ Apply telephone handset BW [300, 3200] Hz to a [T] or [B, T]
+            signal, zero-padded to the next power of 2 and filtered over
+            the last axis with real FFTs
+        """
+        n = data.shape[-1]
         # find next pow of 2 which is greater or eq to n
-        pow_of_2 = 2 ** (np.ceil(np.log2(n)))
-
-        align_filter_dB = np.array([[0, -200], [50, -40], [100, -20],
-                           [125, -12], [160, -6], [200, 0],
-                           [250, 4], [300, 6], [350, 8], [400, 10],
-                           [500, 11], [600, 12], [700, 12], [800, 12],
-                           [1000, 12], [1300, 12], [1600, 12], [2000, 12],
-                           [2500, 12], [3000, 12], [3250, 12], [3500, 4],
-                           [4000, -200], [5000, -200], [6300, -200], 
-                           [8000, -200]]) 
-        print('align filter dB shape: ', align_filter_dB.shape)
-        num_of_points, trivial = align_filter_dB.shape
-        overallGainFilter = interp1d(align_filter_dB[:, 0], align_filter[:, 1],
-                                     1000)
-
-        x = np.zeros((pow_of_2))
-        x[:data.shape[0]] = data
-
-        x_fft = fftw.fft(x, pow_of_2)
-
-        freq_resolution = srate / pow_of_2
-
-        factorDb = interp1d(align_filter_dB[:, 0],
-                            align_filter_dB[:, 1],
-                                           list(range(0, (pow_of_2 / 2) + 1) *\
-                                                freq_resolution)) - \
-                                           overallGainFilter
-        factor = 10 ** (factorDb / 20)
-
-        factor = [factor, np.fliplr(factor[1:(pow_of_2 / 2 + 1)])]
-        x_fft = x_fft * factor
-
-        y = fftw.ifft(x_fft, pow_of_2)
-
-        data_filtered = y[:n]
-        return data_filtered
-
-
-    def asl_P56(self, x, srate, nbits):
+        pow_of_2 = int(2 ** (np.ceil(np.log2(n))))
+        x_fft = np.fft.rfft(data, pow_of_2, axis=-1)
+        x_fft *= irs_response(pow_of_2, srate)
+        y = np.fft.irfft(x_fft, pow_of_2, axis=-1)
+        data_filtered = y[..., :n]
+        return data_filtered.astype(data.dtype, copy=False)
+
+    def asl_P56(self, x, srate, nbits, key=None):
+        """ ITU P.56 method B, cached per utterance by key (e.g. its
+            name) or by a digest of x if key is None
+        """
+        if self.asl_cache_size <= 0:
+            return self.compute_asl_P56(x, srate, nbits)
+        if key is None:
+            key = hashlib.sha1(np.ascontiguousarray(x).tobytes()).hexdigest()
+        key = (key, srate, nbits)
+        if key in self.asl_cache:
+            self.asl_cache.move_to_end(key)
+            return self.asl_cache[key]
+        res = self.compute_asl_P56(x, srate, nbits)
+        self.asl_cache[key] = res
+        if len(self.asl_cache) > self.asl_cache_size:
+            self.asl_cache.popitem(last=False)
+        return res
+
+    def cached_level(self, key, srate=16000, nbits=16):
+        """ P.56 active speech level cached for key, or None """
+        key = (key, srate, nbits)
+        if key not in self.asl_cache:
+            return None
+        self.asl_cache.move_to_end(key)
+        return self.asl_cache[key][0]
+
+    def compute_asl_P56(self, x, srate, nbits):
         """ ITU P.56 method B. """
         T = 0.03 # time constant of smoothing in seconds
         H = 0.2 # hangover time in seconds
@@ -192,7 +332,6 @@ class Additive(object):
         # array of thresholds from one quantizing level up to half the max
         # code, at a step of 2. In case of 16bit: from 2^-15 to 0.5
         a = np.zeros(c.shape[0]) # activity counter for each level thres
-        hang = np.ones(c.shape[0]) * I # hangover counter for each level thres
 
         assert x.ndim == 1, x.shape
         sq = np.dot(x, x) # long term level square energy of x
@@ -203,16 +342,19 @@ class Additive(object):
         p = lfilter(np.ones(1) - g, np.array([1, -g]), x_abs)
         q = lfilter(np.ones(1) - g, np.array([1, -g]), p)
 
-        for k in range(x_len):
-            for j in range(thres_no):
-                if q[k] >= c[j]:
-                    a[j] = a[j] + 1
-                    hang[j] = 0
-                elif hang[j] < I:
-                    a[j] = a[j] + 1
-                    hang[j] = hang[j] + 1
-                else:
-                    break
+        # A sample is active for threshold j if q reached c[j] at most I
+        # samples before (hangover). Hangover counters grow with j, as
+        # higher thresholds are reached less often, so thresholds can be
+        # counted independently of each other.
+        steps = np.arange(x_len)
+        for j in range(thres_no):
+            over = q >= c[j]
+            if not np.any(over):
+                # nor any higher threshold
+                break
+            last_over = np.maximum.accumulate(np.where(over, steps, -1))
+            a[j] = np.count_nonzero((last_over >= 0) & \
+                                    (steps - last_over <= I))
         asl = 0
         asl_ms = 0
         c0 = None
@@ -0,0 +1,40 @@
+import copy
+import torch
+import pytest
+from segan.models import Discriminator
+
+
+def make_discriminator(norm_type):
+    torch.manual_seed(0)
+    return Discriminator(2, [8, 16], 31, [4, 4], pool_type='none',
+                         pool_slen=16, norm_type=norm_type)
+
+
+def train_step(D, compiled):
+    torch.manual_seed(1)
+    x = torch.randn(4, 2, 256)
+    if compiled:
+        y = torch.compile(D.forward_graph)(x)
+    else:
+        y, _ = D(x)
+    y.sum().backward()
+
+
+@pytest.mark.parametrize('compiled', [False, True])
+@pytest.mark.parametrize('norm_type', ['bnorm', 'snorm'])
+def test_checkpoint_keeps_stats(norm_type, compiled):
+    if compiled and not hasattr(torch, 'compile'):
+        pytest.skip('no torch.compile')
+    D = make_discriminator(norm_type)
+    D_ckpt = copy.deepcopy(D)
+    D_ckpt.checkpoint_blocks = True
+    train_step(D, compiled)
+    train_step(D_ckpt, compiled)
+    # running stats (and spectral norm u) updated once, as without
+    # checkpointing
+    for name, buf in D.named_buffers():
+        assert torch.allclose(buf, dict(D_ckpt.named_buffers())[name],
+                              atol=1e-6), name
+    for name, param in D.named_parameters():
+        grad = dict(D_ckpt.named_parameters())[name].grad
+        assert torch.allclose(param.grad, grad, atol=1e-5), name
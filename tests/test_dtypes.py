@@ -0,0 +1,85 @@
+import os
+import numpy as np
+import soundfile as sf
+import torch
+import pytest
+from segan.datasets import SEDataset
+from segan.datasets.se_dataset import normalize_wave_minmax, \
+                                      abs_normalize_wave_minmax, \
+                                      abs_short_normalize_wave_minmax, \
+                                      dynamic_normalize_wave_minmax, \
+                                      pre_emphasize
+from segan.utils import Additive
+
+# wavs are int16 on disk and float32 in memory: no stage may widen them
+
+
+def int16_wav(length, seed=0):
+    rng = np.random.RandomState(seed)
+    return (3000 * rng.randn(length)).astype(np.int16)
+
+
+def write_wavs(wav_dir, lengths, seed=0):
+    os.makedirs(str(wav_dir))
+    for w_i, length in enumerate(lengths):
+        sf.write(os.path.join(str(wav_dir), 'utt_{}.wav'.format(w_i)),
+                 int16_wav(length, seed + w_i), 16000, subtype='PCM_16')
+
+
+@pytest.mark.parametrize('dtype', [np.int16, np.float32])
+def test_normalize_and_pre_emphasize(dtype):
+    x = int16_wav(1000).astype(dtype)
+    assert normalize_wave_minmax(x).dtype == np.float32
+    assert pre_emphasize(x, 0.95).dtype == np.float32
+    assert pre_emphasize(x.reshape(4, -1), 0.95).dtype == np.float32
+    if dtype == np.int16:
+        assert abs_normalize_wave_minmax(x).dtype == np.float32
+        assert abs_short_normalize_wave_minmax(x).dtype == np.float32
+        assert dynamic_normalize_wave_minmax(x).dtype == np.float32
+
+
+@pytest.mark.parametrize('additive', [False, True])
+@pytest.mark.parametrize('preemph_norm', [False, True])
+def test_dataset_slices(tmp_path, additive, preemph_norm):
+    write_wavs(tmp_path / 'clean', [3000, 2500])
+    noises = None
+    if additive:
+        write_wavs(tmp_path / 'noises', [20000, 30000], seed=10)
+        noises = Additive(str(tmp_path / 'noises'))
+    else:
+        write_wavs(tmp_path / 'noisy', [3000, 2500], seed=20)
+    dset = SEDataset(str(tmp_path / 'clean'), str(tmp_path / 'noisy'),
+                     0.95, cache_dir=str(tmp_path / 'cache'),
+                     slice_size=1024, slice_workers=1,
+                     preemph_norm=preemph_norm, additive=noises)
+    assert len(dset) > 1
+    for index in range(len(dset)):
+        c_slice, n_slice = dset.extract_slice(index)[:2]
+        assert c_slice.dtype == np.float32
+        assert n_slice.dtype == np.float32
+        assert c_slice.shape == (1024,)
+        item = dset[index]
+        # mixed on the fly, tagged for the WSEGAN den_loss mask
+        assert ('additive' in item[0]) == additive
+        assert item[1].dtype == torch.float32
+        assert item[2].dtype == torch.float32
+    # zero padding of short slices
+    c_slice, n_slice = dset.fit_slices(c_slice[:500], n_slice[:600])
+    assert c_slice.dtype == np.float32
+    assert n_slice.dtype == np.float32
+    assert c_slice.shape == (1024,)
+
+
+@pytest.mark.parametrize('do_IRS', [False, True])
+def test_additive_mixer(tmp_path, do_IRS):
+    write_wavs(tmp_path / 'noises', [20000], seed=10)
+    additive = Additive(str(tmp_path / 'noises'), do_IRS=do_IRS)
+    clean = normalize_wave_minmax(int16_wav(4000))
+    noise = additive.noise_data(0)
+    assert noise.dtype == np.float32
+    noisy, _ = additive.addnoise_asl(clean, noise, 16000, 16, 5.,
+                                     do_IRS=do_IRS)
+    assert noisy.dtype == np.float32
+    assert additive(clean).dtype == torch.float32
+    noisy = additive.mix_batch(torch.from_numpy(clean).view(2, -1))[0]
+    assert noisy.dtype == torch.float32
@@ -0,0 +1,39 @@
+import torch
+import pytest
+from segan.models import Generator
+
+
+def make_generator():
+    torch.manual_seed(0)
+    return Generator(1, [16, 32, 32, 64], 31, [4, 4, 4, 4], z_dim=64,
+                     skip_type='alpha', skip_init='randn')
+
+
+@pytest.mark.parametrize('T', [4094, 4095, 4096, 4097, 12799, 12801])
+def test_forward_graph_matches_eager(T):
+    G = make_generator()
+    x = torch.randn(2, 1, T)
+    z = torch.randn(*G.z_size(x))
+    with torch.no_grad():
+        y, hall = G(x, z=z, ret_hid=True)
+        y_graph, code = G.forward_graph(x, z)
+    code_eager = hall['enc_{}'.format(len(G.enc_blocks) - 1)]
+    assert z.shape[2] == code_eager.shape[2]
+    assert torch.equal(code, code_eager)
+    assert torch.equal(y_graph, y)
+
+
+@pytest.mark.parametrize('block', ['enc_4', 'dec_7', 'skip_3', 'enc_x',
+                                   'enc_-1', 'mid', 'mid_0'])
+def test_checkpoint_blocks_rejected(block):
+    with pytest.raises(ValueError):
+        Generator(1, [16, 32, 32, 64], 31, [4, 4, 4, 4], z_dim=64,
+                  checkpoint_blocks=[block])
+
+
+def test_checkpoint_blocks():
+    G = Generator(1, [16, 32, 32, 64], 31, [4, 4, 4, 4], z_dim=64,
+                  checkpoint_blocks=['enc', 'dec_3', 'skip_2'])
+    assert G.checkpoint_blocks == set([('enc', 0), ('enc', 1), ('enc', 2),
+                                       ('enc', 3), ('dec', 3),
+                                       ('skip', 2)])
@@ -0,0 +1,49 @@
+import torch
+from torch.utils.data import DataLoader, Dataset
+import pytest
+from segan.datasets import PooledCollate
+
+
+class CountDataset(Dataset):
+    """ SE-like items whose clean slice is filled with its index """
+    def __init__(self, num_samples, slice_size=16):
+        self.num_samples = num_samples
+        self.slice_size = slice_size
+
+    def __getitem__(self, index):
+        clean = torch.full((self.slice_size,), float(index))
+        return 'utt_{}'.format(index), clean, -clean, torch.LongTensor([0])
+
+    def __len__(self):
+        return self.num_samples
+
+
+@pytest.mark.parametrize('num_workers', [0, 2])
+def test_batch_held_past_pool_size(num_workers):
+    pool_size = 4
+    batch_size = 4
+    # enough batches for every worker to cycle its ring twice
+    num_batches = 2 * pool_size * max(1, num_workers) + 1
+    dloader = DataLoader(CountDataset(num_batches * batch_size),
+                         batch_size=batch_size, shuffle=False,
+                         num_workers=num_workers,
+                         collate_fn=PooledCollate(pool_size))
+    held = None
+    for bidx, (uttname, clean, noisy, _) in enumerate(dloader):
+        first = bidx * batch_size
+        assert uttname[0] == 'utt_{}'.format(first)
+        assert (clean[:, 0] == torch.arange(first, first + batch_size,
+                                            dtype=clean.dtype)).all()
+        assert (noisy == -clean).all()
+        if held is None:
+            held = clean
+            held_copy = clean[:2].clone()
+    # a cloned batch survives the ring, the raw one is recycled
+    assert held_copy[:, 0].tolist() == [0., 1.]
+    assert held[0, 0].item() != 0.
+
+
+@pytest.mark.parametrize('pool_size', [1, 2, 3])
+def test_pool_smaller_than_in_flight(pool_size):
+    with pytest.raises(ValueError):
+        PooledCollate(pool_size)
@@ -2,8 +2,12 @@ import argparse
 import torch
 import torch.nn as nn
 from torch.utils.data import DataLoader
+from torch.utils.data.sampler import WeightedRandomSampler, RandomSampler
 from segan.models import SEGAN, WSEGAN, AEWSEGAN
 from segan.datasets import SEDataset, SEH5Dataset, collate_fn
+from segan.datasets import UtteranceGroupSampler, H5BlockSampler
+from segan.datasets import InfiniteSampler
+from segan.datasets import h5_block_collate, PooledCollate, seed_worker
 from segan.utils import Additive
 import numpy as np
 import random
@@ -38,7 +42,13 @@ def main(opts):
         segan.G.load_pretrained(opts.g_pretrained_ckpt, True)
     if opts.d_pretrained_ckpt is not None:
         segan.D.load_pretrained(opts.d_pretrained_ckpt, True)
+    if opts.compile:
+        # stateless graph forwards of G and D
+        segan.compile_graphs()
     # create Dataset(s) and Dataloader(s)
+    h5_cache_bytes = None
+    if opts.h5_cache_mb is not None:
+        h5_cache_bytes = int(opts.h5_cache_mb * 2 ** 20)
     if opts.h5:
         # H5 Dataset with processed speech chunks
         if opts.h5_data_root is None:
@@ -46,8 +56,18 @@ def main(opts):
         dset = SEH5Dataset(opts.h5_data_root, split='train',
                            preemph=opts.preemph,
                            verbose=True,
-                           random_scale=opts.random_scale)
+                           random_scale=opts.random_scale,
+                           chunk_cache_bytes=h5_cache_bytes)
     else:
+        additive = None
+        if opts.noises_dir is not None:
+            # noisy slices mixed on the fly from a memory-mapped bank
+            if not os.path.exists(opts.cache_dir):
+                os.makedirs(opts.cache_dir)
+            additive = Additive(opts.noises_dir, snr_levels=opts.snr_levels,
+                                bank_path=os.path.join(opts.cache_dir,
+                                                       'noise_bank'),
+                                workers=opts.slice_workers)
         # Directory Dataset from raw wav files
         dset = SEDataset(opts.clean_trainset, 
                          opts.noisy_trainset, 
@@ -61,17 +81,57 @@ def main(opts):
                          verbose=True,
                          slice_workers=opts.slice_workers,
                          preemph_norm=opts.preemph_norm,
-                         random_scale=opts.random_scale
+                         random_scale=opts.random_scale,
+                         packed=opts.packed,
+                         cache_bytes=int(opts.wav_cache_mb * 2 ** 20),
+                         additive=additive,
+                         activity_db=opts.activity_db,
+                         min_activity=opts.min_activity
                         )
-    dloader = DataLoader(dset, batch_size=opts.batch_size,
-                         shuffle=True, num_workers=opts.num_workers,
-                         pin_memory=CUDA,
-                         collate_fn=collate_fn)
+    sampler = None
+    if opts.utt_group > 1 and not opts.h5:
+        # slices of one utterance go together to a worker batch
+        sampler = UtteranceGroupSampler(dset.slice_table['file_id'],
+                                        group_size=opts.utt_group,
+                                        seed=opts.seed)
+    elif opts.activity_weighted and not opts.h5:
+        # slices drawn proportionally to their speech activity
+        weights = np.asarray(dset.slice_table['activity'], dtype=np.float64)
+        sampler = WeightedRandomSampler(weights.tolist(), len(dset))
+    if opts.h5 and opts.h5_block is not None:
+        # every DataLoader item is a whole batch read in one HDF5 call
+        sampler = H5BlockSampler(len(dset), opts.batch_size,
+                                 contiguous=opts.h5_block == 'contiguous',
+                                 seed=opts.seed)
+        if opts.wsegan or opts.aewsegan:
+            sampler = InfiniteSampler(sampler)
+        dloader = DataLoader(dset, batch_size=1, sampler=sampler,
+                             num_workers=opts.num_workers,
+                             pin_memory=CUDA,
+                             collate_fn=h5_block_collate)
+    else:
+        batch_collate = collate_fn
+        if opts.collate_pool > 0:
+            # batches written into recycled shared memory buffers
+            batch_collate = PooledCollate(opts.collate_pool)
+        if opts.wsegan or opts.aewsegan:
+            # W/AEWSEGAN draw batches by iteration, not by epoch: an
+            # endless sampler keeps the workers prefetching throughout
+            if sampler is None:
+                sampler = RandomSampler(dset)
+            sampler = InfiniteSampler(sampler)
+        dloader = DataLoader(dset, batch_size=opts.batch_size,
+                             shuffle=sampler is None, sampler=sampler,
+                             num_workers=opts.num_workers,
+                             pin_memory=CUDA,
+                             collate_fn=batch_collate,
+                             worker_init_fn=seed_worker)
     if opts.clean_valset is not None:
         if opts.h5:
-            dset = SEH5Dataset(opts.h5_data_root, split='valid',
-                               preemph=opts.preemph,
-                               verbose=True)
+            va_dset = SEH5Dataset(opts.h5_data_root, split='valid',
+                                  preemph=opts.preemph,
+                                  verbose=True,
+                                  chunk_cache_bytes=h5_cache_bytes)
         else:
             va_dset = SEDataset(opts.clean_valset, 
                                 opts.noisy_valset, 
@@ -84,7 +144,8 @@ def main(opts):
                                 max_samples=opts.max_samples,
                                 verbose=True,
                                 slice_workers=opts.slice_workers,
-                                preemph_norm=opts.preemph_norm)
+                                preemph_norm=opts.preemph_norm,
+                                packed=opts.packed)
         va_dloader = DataLoader(va_dset, batch_size=300,
                                 shuffle=False, num_workers=opts.num_workers,
                                 pin_memory=CUDA,
@@ -98,7 +159,7 @@ def main(opts):
                 va_dloader=va_dloader, device=device)
 
 
-if __name__ == '__main__':
+def make_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('--save_path', type=str, default="seganv1_ckpt",
                         help="Path to save models (Def: seganv1_ckpt).")
@@ -113,6 +174,27 @@ if __name__ == '__main__':
                         default='data/clean_trainset')
     parser.add_argument('--noisy_trainset', type=str,
                         default='data/noisy_trainset')
+    parser.add_argument('--activity_db', type=float, default=None,
+                        help='Measure the speech activity of every slice, '
+                             'active being within this many dB of the '
+                             'utterance peak envelope, e.g. -40 '
+                             '(Def: None, not measured).')
+    parser.add_argument('--min_activity', type=float, default=0,
+                        help='Drop slices with a smaller fraction of '
+                             'active samples (Def: 0).')
+    parser.add_argument('--activity_weighted', action='store_true',
+                        default=False,
+                        help='Sample slices with probability proportional '
+                             'to their activity, measured with '
+                             '--activity_db (Def: False).')
+    parser.add_argument('--noises_dir', type=str, default=None,
+                        help='Dir of noise wavs to mix on the fly with '
+                             'the clean trainset, instead of reading '
+                             'noisy_trainset (Def: None).')
+    parser.add_argument('--snr_levels', type=float, nargs='+',
+                        default=[0, 5, 10],
+                        help='SNRs in dB of the on the fly mixing '
+                             '(Def: 0 5 10).')
     parser.add_argument('--clean_valset', type=str,
                         default=None)#'data/clean_valset')
     parser.add_argument('--noisy_valset', type=str,
@@ -123,6 +205,29 @@ if __name__ == '__main__':
                              '{train, valid, test}.h5')
     parser.add_argument('--h5', action='store_true', default=False,
                         help='Activate H5 dataset mode (Def: False).')
+    parser.add_argument('--h5_block', type=str, default=None,
+                        choices=['contiguous', 'sorted'],
+                        help='Read H5 batches with one HDF5 call, as '
+                             'contiguous blocks or sorted random '
+                             'indices (Def: None).')
+    parser.add_argument('--h5_cache_mb', type=float, default=None,
+                        help='MB of HDF5 chunk cache per open H5 file '
+                             '(Def: None, h5py default).')
+    parser.add_argument('--collate_pool', type=int, default=0,
+                        help='Recycle a ring of this many shared memory '
+                             'batch buffers per worker, >= 4 (the batches '
+                             'in flight per worker). Batches alias the '
+                             'buffers: clone what is kept longer than '
+                             'that (Def: 0, off).')
+    parser.add_argument('--packed', action='store_true', default=False,
+                        help='Read slices from a memory-mapped packed '
+                             'corpus built in cache_dir (Def: False).')
+    parser.add_argument('--utt_group', type=int, default=1,
+                        help='Slices of the same utterance sampled together '
+                             'in shuffled groups of this size (Def: 1).')
+    parser.add_argument('--wav_cache_mb', type=float, default=0,
+                        help='MB of processed wavs kept in an LRU cache '
+                             'by each DataLoader worker (Def: 0).')
     parser.add_argument('--data_stride', type=float,
                         default=0.5, help='Stride in seconds for data read')
     parser.add_argument('--seed', type=int, default=111, 
@@ -138,6 +243,12 @@ if __name__ == '__main__':
                              'avoid patience by setting it high atm (Def: 100).'
                        )
     parser.add_argument('--batch_size', type=int, default=100)
+    parser.add_argument('--micro_batch', type=int, default=None,
+                        help='Max samples per forward pass, the grads of '
+                             'a batch are accumulated over micro-batches '
+                             'of this size. BatchNorm layers see per '
+                             'micro-batch statistics, unlike with the '
+                             'whole batch (Def: None, whole batch).')
     parser.add_argument('--save_freq', type=int, default=50,
                         help="Batch save freq (Def: 50).")
     parser.add_argument('--slice_size', type=int, default=16384)
@@ -162,6 +273,13 @@ if __name__ == '__main__':
                         help='DataLoader number of workers (Def: 1).')
     parser.add_argument('--no-cuda', action='store_true', default=False,
                         help='Disable CUDA even if device is available')
+    parser.add_argument('--compile', action='store_true', default=False,
+                        help='Run G and D through their graph forwards, '
+                             'compiled with torch.compile (Def: False).')
+    parser.add_argument('--amp', action='store_true', default=False,
+                        help='Mixed precision training: autocast to fp16 '
+                             'with loss scaling on GPU, to bf16 on CPU '
+                             '(Def: False).')
     parser.add_argument('--random_scale', type=float, nargs='+', 
                         default=[1], help='Apply randomly a scaling factor' \
                                           'in list to the (clean, noisy) pair')
@@ -193,6 +311,10 @@ if __name__ == '__main__':
     parser.add_argument('--skip_init', type=str, default='one',
                         help='Way to init skip connections (Def: one)')
     parser.add_argument('--skip_kwidth', type=int, default=11)
+    parser.add_argument('--g_checkpoint', type=str, nargs='+', default=[],
+                        help='G blocks recomputed in backward to save '
+                             'activation memory: enc, dec, skip or a '
+                             'single one like enc_0 (Def: none).')
 
     # Generator parameters
     parser.add_argument('--gkwidth', type=int, default=31)
@@ -243,9 +365,37 @@ if __name__ == '__main__':
                         '(Def: bnorm).')
     parser.add_argument('--phase_shift', type=int, default=5)
     parser.add_argument('--sinc_conv', action='store_true', default=False)
+    parser.add_argument('--d_checkpoint', action='store_true', default=False,
+                        help='Recompute D blocks in backward to save '
+                             'activation memory (Def: False).')
+    return parser
 
+
+if __name__ == '__main__':
+    parser = make_parser()
     opts = parser.parse_args()
     opts.bias = not opts.no_bias
+    if opts.activity_weighted and opts.utt_group > 1:
+        parser.error('--activity_weighted cannot be combined with '
+                     '--utt_group > 1')
+    if opts.activity_weighted and opts.h5:
+        parser.error('--activity_weighted is not available with --h5')
+    if opts.activity_weighted and opts.activity_db is None:
+        # otherwise every slice has activity 1: uniform sampling
+        parser.error('--activity_weighted requires --activity_db')
+    if 0 < opts.collate_pool < 4:
+        parser.error('--collate_pool has to be 0 (off) or >= 4, the '
+                     'batches in flight per worker')
+    if opts.micro_batch is not None and opts.micro_batch < opts.batch_size:
+        bnorms = [m for m, norm_type in [('G', opts.gnorm_type),
+                                         ('D', opts.dnorm_type)] \
+                  if norm_type == 'bnorm' and \
+                  not (m == 'D' and opts.aewsegan)]
+        if len(bnorms) > 0:
+            print('WARNING: {} BatchNorm normalizes each micro-batch of {} '
+                  'with its own statistics, training differs from whole '
+                  'batches of {}'.format(' and '.join(bnorms),
+                                         opts.micro_batch, opts.batch_size))
 
     if not os.path.exists(opts.save_path):
         os.makedirs(opts.save_path)